@@ -0,0 +1,117 @@
+import hashlib
+import io
+import json
+import os
+import pygame
+from atomic import atomic_write
+
+# Scaled atlases are cached here, keyed by a hash of the source files and the scale
+CACHE_DIR = "./.cache/assets"
+
+# Widest atlas before frames wrap onto a new row
+ATLAS_WIDTH = 1024
+
+# Frames already loaded in this process, shared by every Player and the Game
+loaded = {}
+
+
+def source_files(path):
+    """sorted PNG files in a directory"""
+    return [os.path.join(path, filename) for filename in sorted(os.listdir(path)) if filename.endswith(".png")]
+
+
+def cache_key(paths, scale_factor, size):
+    """hash of the source files and how they are scaled"""
+    digest = hashlib.sha1(f"{scale_factor}:{size}".encode())
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def scale_image(image, scale_factor, size):
+    """scale an image to a size or by a factor"""
+    if size is not None:
+        return pygame.transform.scale(image, size)
+    if scale_factor != 1:
+        return pygame.transform.scale(image, (image.get_width() * scale_factor, image.get_height() * scale_factor))
+    return image
+
+
+def pack(images):
+    """pack images into rows of one atlas surface, returns the atlas and a rect per image"""
+    rects = []
+    x = y = row_height = width = 0
+    for image in images:
+        if x and x + image.get_width() > ATLAS_WIDTH:
+            x = 0
+            y += row_height
+            row_height = 0
+        rects.append(pygame.Rect((x, y), image.get_size()))
+        x += image.get_width()
+        width = max(width, x)
+        row_height = max(row_height, image.get_height())
+
+    atlas = pygame.Surface((max(width, 1), max(y + row_height, 1)), pygame.SRCALPHA)
+    for image, rect in zip(images, rects):
+        atlas.blit(image, rect)
+    return atlas, rects
+
+
+def save_atlas(atlas, rects, image_path, rects_path):
+    """write an atlas and its rects to the cache, a missing or read-only cache is not an error"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        image = io.BytesIO()
+        pygame.image.save(atlas, image, "png")
+        atomic_write(image_path, image.getvalue())
+        atomic_write(rects_path, json.dumps([list(rect) for rect in rects]))
+    except (OSError, pygame.error):
+        pass
+
+
+def load_atlas(name, paths, scale_factor=1, size=None):
+    """load images scaled and packed into one atlas, returns a subsurface per image
+
+    The scaled atlas is read from the disk cache when the sources havent changed"""
+    loaded_key = (tuple(paths), scale_factor, size)
+    if loaded_key in loaded:
+        return loaded[loaded_key]
+
+    key = cache_key(paths, scale_factor, size)
+
+    image_path = os.path.join(CACHE_DIR, f"{name}-{key}.png")
+    rects_path = os.path.join(CACHE_DIR, f"{name}-{key}.json")
+
+    try:
+        atlas = pygame.image.load(image_path).convert_alpha()
+        with open(rects_path) as f:
+            rects = [pygame.Rect(rect) for rect in json.load(f)]
+    except (OSError, ValueError, pygame.error):
+        images = [scale_image(pygame.image.load(path).convert_alpha(), scale_factor, size) for path in paths]
+        atlas, rects = pack(images)
+        save_atlas(atlas, rects, image_path, rects_path)
+
+    frames = [atlas.subsurface(rect) for rect in rects]
+    loaded[loaded_key] = frames
+    return frames
+
+
+def load_directory(path, scale_factor=1, size=None):
+    """load every PNG in a directory as one atlas"""
+    name = os.path.basename(os.path.normpath(path))
+    return load_atlas(name, source_files(path), scale_factor, size)
+
+
+class Animations(dict):
+    """Animation frames by name, each animation is loaded the first time it is used"""
+    def __init__(self, paths, scale_factor=1):
+        super().__init__()
+        self.paths = paths
+        self.scale_factor = scale_factor
+
+    def __missing__(self, name):
+        frames = load_directory(self.paths[name], self.scale_factor)
+        self[name] = frames
+        return frames
@@ -0,0 +1,30 @@
+import os
+
+
+def temporary_path(path):
+    """hidden file next to path that a new version is written to before it replaces path"""
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.tmp")
+
+
+def atomic_write(path, data):
+    """write bytes or text to a file so a crash leaves either the old or the new file, never half of one
+
+    The data is written to a temporary file in the same directory, synced to disk and renamed over path"""
+    temporary = temporary_path(path)
+    if isinstance(data, str):
+        f = open(temporary, "w", newline="")
+    else:
+        f = open(temporary, "wb")
+    try:
+        with f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,347 @@
+"""Steps many players at once with NumPy, with the same results as PlayerPhysics
+
+    python batch.py             check that both agree on every level in levels/
+"""
+import argparse
+import sys
+import numpy as np
+import level_format
+from simulation import PlayerPhysics, INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP, HITBOX_SIZE, SUBSTEPS, frame_ticks
+
+# Animation names stored as small ints in the batch state
+ANIMATIONS = ["idle", "run", "jump", "death"]
+IDLE, RUN, JUMP, DEATH = range(len(ANIMATIONS))
+
+# Per player state arrays, stepped only for players that are alive
+STATE_ARRAYS = [
+    "pos_x", "pos_y", "vel_x", "vel_y", "acc_x", "acc_y", "rect_x", "rect_y",
+    "grounded", "is_jumping", "has_won", "dead", "dead_screen", "is_playing_jump_animation",
+    "current_animation", "current_frame", "animation_timer",
+]
+
+
+class BatchPhysics:
+    """Struct-of-arrays version of PlayerPhysics that steps many players against one level at once"""
+    def __init__(self, count, world_data, TILE_SIZE=32, x=0, y=0, acceleration=0.5, gravity=0.5,
+                 frame_counts=None, hitbox_size=HITBOX_SIZE, substeps=SUBSTEPS):
+        # The scalar physics is the reference for every rule and constant used here
+        self.reference = PlayerPhysics(x, y, acceleration, gravity, frame_counts, hitbox_size, substeps)
+        self.count = count
+        self.TILE_SIZE = TILE_SIZE
+        self.width, self.height = hitbox_size
+        self.frame_counts = np.array([self.reference.frame_counts[name] for name in ANIMATIONS])
+
+        self.pos_x = np.full(count, float(x))
+        self.pos_y = np.full(count, float(y))
+        self.vel_x = np.zeros(count)
+        self.vel_y = np.zeros(count)
+        self.acc_x = np.zeros(count)
+        self.acc_y = np.zeros(count)
+        self.rect_x = np.full(count, int(x), dtype=np.int64)
+        self.rect_y = np.full(count, int(y), dtype=np.int64)
+
+        self.grounded = np.zeros(count, dtype=bool)
+        self.is_jumping = np.zeros(count, dtype=bool)
+        self.has_won = np.zeros(count, dtype=bool)
+        self.dead = np.zeros(count, dtype=bool)
+        self.dead_screen = np.zeros(count, dtype=bool)
+        self.is_playing_jump_animation = np.zeros(count, dtype=bool)
+
+        self.current_animation = np.full(count, IDLE, dtype=np.int64)
+        self.current_frame = np.zeros(count, dtype=np.int64)
+        self.animation_timer = np.zeros(count)
+
+        self.set_world(world_data)
+
+    def set_world(self, world_data):
+        """build grid lookup arrays for tile ids and tile hitboxes"""
+        hitboxes = self.reference.build_tile_hitboxes(world_data, self.TILE_SIZE)
+        rows = len(hitboxes)
+        cols = len(hitboxes[0]) if rows else 0
+
+        self.rows, self.cols = rows, cols
+        self.tiles = np.full((rows, cols), -1, dtype=np.int64)
+        self.tile_boxes = np.zeros((4, rows, cols), dtype=np.int64)
+        for y, row in enumerate(hitboxes):
+            for x, hitbox in enumerate(row):
+                if hitbox is not None:
+                    tile, tile_rect = hitbox
+                    self.tiles[y, x] = tile
+                    self.tile_boxes[:, y, x] = (tile_rect.left, tile_rect.top, tile_rect.right, tile_rect.bottom)
+
+        # Tile properties as arrays indexed by tile id
+        tile_types = self.reference.tile_types
+        self.solid = np.frombuffer(bytes(tile_types.solid), dtype=bool)
+        self.deadly = np.frombuffer(bytes(tile_types.deadly), dtype=bool)
+        self.goal = np.frombuffer(bytes(tile_types.goal), dtype=bool)
+
+    def tiles_in_area(self, left, top, right, bottom):
+        """tiles in the grid cells each area in pixels covers, like PlayerPhysics.tiles_in_area
+
+        Returns tile ids and hitboxes with shape (players, cells), tile id -1 means no tile"""
+        TILE_SIZE = self.TILE_SIZE
+        first_col = np.floor_divide(left, TILE_SIZE).astype(np.int64)
+        first_row = np.floor_divide(top, TILE_SIZE).astype(np.int64)
+        last_col = (-np.floor_divide(-right, TILE_SIZE)).astype(np.int64) - 1
+        last_row = (-np.floor_divide(-bottom, TILE_SIZE)).astype(np.int64) - 1
+
+        # Every area gets the same number of cells, enough for the largest one
+        span_cols = max(int((last_col - first_col).max(initial=0)) + 1, 1)
+        span_rows = max(int((last_row - first_row).max(initial=0)) + 1, 1)
+
+        offset_rows, offset_cols = np.divmod(np.arange(span_rows * span_cols), span_cols)
+        cell_rows = first_row[:, None] + offset_rows
+        cell_cols = first_col[:, None] + offset_cols
+        in_grid = (
+            (cell_rows <= last_row[:, None]) & (cell_cols <= last_col[:, None]) &
+            (cell_rows >= 0) & (cell_cols >= 0) & (cell_rows < self.rows) & (cell_cols < self.cols)
+        )
+        cell_rows = np.where(in_grid, cell_rows, 0)
+        cell_cols = np.where(in_grid, cell_cols, 0)
+
+        tiles = np.where(in_grid, self.tiles[cell_rows, cell_cols], -1)
+        tile_left, tile_top, tile_right, tile_bottom = self.tile_boxes[:, cell_rows, cell_cols]
+        return tiles, tile_left, tile_top, tile_right, tile_bottom
+
+    def sweep(self, pos_x, pos_y, dx, dy, has_won, dead):
+        """move each hitbox along one axis until the first solid tile in the way, like PlayerPhysics.sweep
+
+        dx or dy is an array of distances and the other 0. Returns the new positions and the side hit,
+        1 moving right or down, -1 moving left or up, 0 when nothing was hit"""
+        width, height = self.width, self.height
+        horizontal = np.ndim(dx) > 0
+        distance = dx if horizontal else dy
+        moving = distance != 0
+
+        tiles, left, top, right, bottom = self.tiles_in_area(
+            pos_x + np.minimum(dx, 0), pos_y + np.minimum(dy, 0),
+            pos_x + width + np.maximum(dx, 0), pos_y + height + np.maximum(dy, 0),
+        )
+        present = (tiles >= 0) & moving[:, None]
+        tile_ids = np.maximum(tiles, 0)
+
+        # Solid tiles overlapping on the other axis and ahead of the hitbox are in the way
+        x, y = pos_x[:, None], pos_y[:, None]
+        forward = distance[:, None] > 0
+        if horizontal:
+            in_line = (y < bottom) & (y + height > top)
+            gap = np.where(forward, left - (x + width), x - right)
+        else:
+            in_line = (x < right) & (x + width > left)
+            gap = np.where(forward, top - (y + height), y - bottom)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            impact = gap / np.abs(distance)[:, None]
+        blocking = present & self.solid[tile_ids] & in_line & (gap >= 0) & (impact <= 1)
+        impact = np.where(blocking, impact, np.inf)
+        first_impact = impact.min(axis=1)
+        hits = blocking & (impact == first_impact[:, None])
+        hit = hits.any(axis=1)
+
+        # Stop flush against the tile
+        players = np.arange(len(pos_x))
+        first = np.argmax(hits, axis=1)
+        if horizontal:
+            stop = np.where(distance > 0, left[players, first] - width, right[players, first])
+            new_x = np.where(hit, stop, pos_x + dx)
+            new_y = pos_y
+        else:
+            stop = np.where(distance > 0, top[players, first] - height, bottom[players, first])
+            new_x = pos_x
+            new_y = np.where(hit, stop, pos_y + dy)
+
+        # Tiles stopped against or overlapped anywhere along the move
+        area_left = np.minimum(pos_x, new_x)[:, None]
+        area_right = np.maximum(pos_x, new_x)[:, None] + width
+        area_top = np.minimum(pos_y, new_y)[:, None]
+        area_bottom = np.maximum(pos_y, new_y)[:, None] + height
+        touched = hits | (
+            present & (area_left < right) & (area_right > left) & (area_top < bottom) & (area_bottom > top)
+        )
+        goal = touched & self.goal[tile_ids]
+        has_won |= goal.any(axis=1)
+        dead |= (touched & ~goal & self.deadly[tile_ids]).any(axis=1)
+
+        side = np.where(hit, np.sign(distance), 0).astype(np.int64)
+        return new_x, new_y, side
+
+    def take(self, indices):
+        """state arrays of some players, they can be put back with load"""
+        return {name: getattr(self, name)[indices] for name in STATE_ARRAYS}
+
+    def load(self, states):
+        """replace every player with the states in a dict of arrays like take returns"""
+        for name in STATE_ARRAYS:
+            setattr(self, name, np.array(states[name], dtype=getattr(self, name).dtype))
+        self.count = len(self.pos_x)
+
+    def step(self, inputs, ticks):
+        """advance every player one frame, inputs and ticks are given per player (or one for all)"""
+        inputs = np.broadcast_to(np.asarray(inputs, dtype=np.int64), (self.count,))
+        alive = np.flatnonzero(~self.dead)
+        if len(alive):
+            self.step_physics(alive, inputs[alive])
+        self.animate(ticks)
+
+    def step_physics(self, alive, inputs):
+        """movement and collision for the players that were alive at the start of the frame"""
+        ref = self.reference
+        pos_x, pos_y = self.pos_x[alive], self.pos_y[alive]
+        vel_x, vel_y = self.vel_x[alive], self.vel_y[alive]
+        acc_y = self.acc_y[alive]
+        has_won, dead = self.has_won[alive], self.dead[alive]
+        grounded = self.grounded[alive]
+        is_jumping = self.is_jumping[alive]
+        jump_animation = self.is_playing_jump_animation[alive]
+        current_animation, current_frame = self.current_animation[alive], self.current_frame[alive]
+
+        # Horizontal movement, only velocity changes here
+        acc_x = np.where(inputs & INPUT_LEFT, -ref.acceleration,
+                         np.where(inputs & INPUT_RIGHT, ref.acceleration, 0.0))
+        acc_x = acc_x + vel_x * ref.friction
+        vel_x = vel_x + acc_x
+        vel_y = vel_y + acc_y
+        vel_x = np.maximum(-4, np.minimum(vel_x, 4))
+        vel_x = np.where(np.abs(vel_x) < .01, 0.0, vel_x)
+
+        # Vertical movement
+        acc_y = np.full(len(alive), float(ref.gravity))
+        jump = ((inputs & INPUT_JUMP) != 0) & grounded & ~jump_animation
+        vel_y = np.where(jump, -12.0, vel_y)
+        jump_animation = jump_animation | jump
+        current_animation = np.where(jump, JUMP, current_animation)
+        current_frame = np.where(jump, 0, current_frame)
+
+        # Move in substeps, sweeping x and then y against the tiles
+        grounded = np.zeros(len(alive), dtype=bool)
+        substeps = ref.substeps
+        dx = vel_x + 0.5 * acc_x
+        dy = vel_y + 0.5 * acc_y
+        for _ in range(substeps):
+            pos_x, pos_y, side = self.sweep(pos_x, pos_y, dx / substeps, 0, has_won, dead)
+            pos_x, pos_y, side = self.sweep(pos_x, pos_y, 0, dy / substeps, has_won, dead)
+            landing = side > 0
+            grounded |= landing
+            is_jumping = is_jumping & ~landing
+            vel_y = np.where(side != 0, 0.0, vel_y)
+
+        rect_x = np.trunc(pos_x).astype(np.int64)
+        rect_y = np.trunc(pos_y).astype(np.int64)
+        pos_x = rect_x.astype(float)
+        pos_y = rect_y.astype(float)
+
+        # Falling out of the map
+        fell = rect_y > ref.world_height
+        dead = dead | fell
+        current_animation = np.where(fell, DEATH, current_animation)
+        jump_animation = jump_animation & ~fell
+
+        # Map boundaries
+        too_far_left = rect_x < 0
+        too_far_right = ~too_far_left & (rect_x + self.width > ref.world_width)
+        rect_x = np.where(too_far_left, 0, np.where(too_far_right, ref.world_width - self.width, rect_x))
+        pos_x = np.where(too_far_left | too_far_right, rect_x, pos_x)
+
+        self.pos_x[alive], self.pos_y[alive] = pos_x, pos_y
+        self.vel_x[alive], self.vel_y[alive] = vel_x, vel_y
+        self.acc_x[alive], self.acc_y[alive] = acc_x, acc_y
+        self.rect_x[alive], self.rect_y[alive] = rect_x, rect_y
+        self.has_won[alive], self.dead[alive] = has_won, dead
+        self.grounded[alive] = grounded
+        self.is_jumping[alive] = is_jumping
+        self.is_playing_jump_animation[alive] = jump_animation
+        self.current_animation[alive], self.current_frame[alive] = current_animation, current_frame
+
+    def animate(self, ticks):
+        """animation state and frame updates, jumping and the death screen depend on them"""
+        self.current_animation = np.where(
+            self.dead, DEATH, np.where(
+                self.is_playing_jump_animation, JUMP, np.where(self.vel_x != 0, RUN, IDLE)))
+
+        advance = ticks - self.animation_timer > self.reference.animation_speed
+        self.animation_timer = np.where(advance, ticks, self.animation_timer)
+
+        counts = self.frame_counts[self.current_animation]
+        next_frame = self.current_frame + 1
+        play_once = (self.current_animation == DEATH) | (
+            (self.current_animation == JUMP) & self.is_playing_jump_animation)
+        finished = advance & play_once & (next_frame >= counts)
+
+        self.current_frame = np.where(
+            advance, np.where(play_once, np.minimum(next_frame, counts - 1), next_frame % counts),
+            self.current_frame)
+        self.is_playing_jump_animation &= ~(finished & (self.current_animation == JUMP))
+        self.dead_screen |= finished & (self.current_animation == DEATH)
+
+    def state(self, index):
+        """state of one player as a dict, comparable with physics_state"""
+        return {name: getattr(self, name)[index].item() for name in STATE_ARRAYS}
+
+
+def physics_state(physics):
+    """state of a scalar PlayerPhysics as a dict, comparable with BatchPhysics.state"""
+    return {
+        "pos_x": physics.pos.x, "pos_y": physics.pos.y,
+        "vel_x": physics.vel.x, "vel_y": physics.vel.y,
+        "acc_x": physics.acc.x, "acc_y": physics.acc.y,
+        "rect_x": physics.rect.x, "rect_y": physics.rect.y,
+        "grounded": physics.grounded, "is_jumping": physics.is_jumping,
+        "has_won": physics.has_won, "dead": physics.dead, "dead_screen": physics.dead_screen,
+        "is_playing_jump_animation": physics.is_playing_jump_animation,
+        "current_animation": ANIMATIONS.index(physics.current_animation),
+        "current_frame": physics.current_frame, "animation_timer": physics.animation_timer,
+    }
+
+
+def compare_with_scalar(world_data, inputs, TILE_SIZE=32):
+    """run every input sequence through BatchPhysics and PlayerPhysics side by side
+
+    inputs has shape (frames, players). Returns (frame, player, batch state, scalar state)
+    for the first difference, or None when both agree on every frame"""
+    inputs = np.asarray(inputs, dtype=np.int64)
+    frames, count = inputs.shape
+    batch = BatchPhysics(count, world_data, TILE_SIZE)
+    players = [PlayerPhysics(0, 0, 0.5, 0.5, batch.reference.frame_counts) for _ in range(count)]
+
+    for frame in range(frames):
+        ticks = frame_ticks(frame + 1)
+        batch.step(inputs[frame], ticks)
+        for index, physics in enumerate(players):
+            physics.step(int(inputs[frame, index]), world_data, TILE_SIZE, ticks)
+            expected = physics_state(physics)
+            actual = batch.state(index)
+            if actual != expected:
+                return frame, index, actual, expected
+    return None
+
+
+def check_level(world_data, players=40, frames=1500, seed=0, hold=10):
+    """compare_with_scalar on seeded random inputs, each held for hold frames"""
+    rng = np.random.default_rng(seed)
+    inputs = rng.integers(0, (INPUT_LEFT | INPUT_RIGHT | INPUT_JUMP) + 1, size=(-(-frames // hold), players))
+    return compare_with_scalar(world_data, np.repeat(inputs, hold, axis=0)[:frames])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="check that BatchPhysics steps players like PlayerPhysics")
+    parser.add_argument("directory", nargs="?", default="./levels") # directory with the levels
+    parser.add_argument("--players", type=int, default=40) # players stepped side by side on each level
+    parser.add_argument("--frames", type=int, default=1500) # frames stepped on each level
+    parser.add_argument("--seed", type=int, default=0) # seed for the random inputs
+    args = parser.parse_args()
+
+    for level in level_format.list_levels(args.directory):
+        world_data, tileset = level_format.read_level(level_format.level_path(level, args.directory))
+        difference = check_level(world_data, args.players, args.frames, args.seed + level)
+        if difference is not None:
+            frame, player, actual, expected = difference
+            print(f"level {level}: player {player} differs on frame {frame}")
+            for name in STATE_ARRAYS:
+                if actual[name] != expected[name]:
+                    print(f"  {name}: batch {actual[name]} scalar {expected[name]}")
+            return 1
+        print(f"level {level}: {args.players} players agree for {args.frames} frames")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
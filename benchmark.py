@@ -0,0 +1,239 @@
+"""Benchmarks for physics, collision, rendering and level I/O
+
+Runs headless with the SDL dummy video driver. Results are written as JSON and compared
+against a stored baseline, benchmarks that got slower than the threshold are flagged.
+
+    python benchmark.py                    run and compare with benchmark_baseline.json
+    python benchmark.py --save-baseline    run and store the results as the new baseline
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+import random
+import pygame
+import entities
+from main import Game
+from simulation import INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP
+
+# Registered benchmarks as (name, function, repeat)
+BENCHMARKS = []
+
+
+def benchmark(name, repeat=200):
+    """register a function taking the game as a benchmark"""
+    def register(function):
+        BENCHMARKS.append((name, function, repeat))
+        return function
+    return register
+
+
+def keys_for(left=False, right=False, jump=False):
+    """key state in the form Player.update reads it"""
+    return {pygame.K_LEFT: left, pygame.K_RIGHT: right, pygame.K_SPACE: jump}
+
+
+def scripted_inputs(frame):
+    """input script for the gameplay loop as an input bitmask, run right and jump now and then"""
+    inputs = INPUT_RIGHT if frame % 120 < 100 else INPUT_LEFT
+    if frame % 45 == 0:
+        inputs |= INPUT_JUMP
+    return inputs
+
+
+def percentile(samples, percent):
+    """nearest rank percentile of a sorted list"""
+    index = max(0, min(len(samples) - 1, round(percent / 100 * len(samples)) - 1))
+    return samples[index]
+
+
+def summarize(samples):
+    """timing statistics in microseconds"""
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "min_us": samples[0] * 1e6,
+        "mean_us": sum(samples) / len(samples) * 1e6,
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p95_us": percentile(samples, 95) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+    }
+
+
+@benchmark("player.get_tile_collisions", repeat=5000)
+def bench_tile_collisions(game):
+    game.player.get_tile_collisions(game.world_data, game.TILE_SIZE)
+
+
+@benchmark("player.update", repeat=5000)
+def bench_player_update(game, keys=keys_for(right=True)):
+    game.player.update(keys, game.world_data, game.TILE_SIZE)
+    if game.player.dead or game.player.has_won:
+        game.reset()
+
+
+@benchmark("game.draw_background", repeat=500)
+def bench_draw_background(game):
+    game.draw_background()
+
+
+@benchmark("game.draw_world", repeat=500)
+def bench_draw_world(game):
+    game.draw_world()
+
+
+@benchmark("game.draw_static_layer", repeat=2000)
+def bench_draw_static_layer(game):
+    game.draw_static_layer()
+
+
+@benchmark("game.load_level", repeat=200)
+def bench_load_level(game):
+    game.load_level()
+
+
+@benchmark("game.save", repeat=200)
+def bench_save(game):
+    game.compact_journal(force=True)
+
+
+def many_entities(game, count=500):
+    """a store of moving entities spread over the screen, made once per game"""
+    if not hasattr(game, "benchmark_entities"):
+        rng = random.Random(0)
+        game.benchmark_entities = entities.EntityStore([
+            {"kind": rng.choice(entities.KIND_NAMES), "x": rng.uniform(0, game.COLS - 1), "y": rng.uniform(0, game.ROWS - 2),
+             "dx": rng.choice([-2, -1, 1, 2]), "distance": rng.randint(2, 10)}
+            for _ in range(count)
+        ], game.TILE_SIZE, game.tile_list)
+    return game.benchmark_entities
+
+
+@benchmark("entities.update", repeat=2000)
+def bench_entities_update(game):
+    store = many_entities(game)
+    store.update(game.player)
+    store.collide(game.player)
+
+
+@benchmark("entities.draw", repeat=500)
+def bench_entities_draw(game):
+    many_entities(game).draw(game.screen)
+
+
+def gameplay_loop(game, frames):
+    """time every frame of a scripted run through the game scene of run_game, one simulation step per frame"""
+    game.reset()
+    game.full_redraw = True
+    samples = []
+    for frame in range(frames):
+        start = time.perf_counter()
+
+        pygame.event.pump()
+        full_redraw = game.full_redraw or not game.dirty_rect_mode
+        game.full_redraw = False
+        game.reload_changed_level()
+        next_scene = game.step_player(scripted_inputs(frame))
+        game.draw_frame(full_redraw, False)
+        game.update_display(full_redraw or game.full_redraw)
+
+        samples.append(time.perf_counter() - start)
+
+        if next_scene:
+            game.reset()
+            game.full_redraw = True
+    return samples
+
+
+def run(level, frames):
+    """run every benchmark and return the results"""
+    game = Game("game")
+    game.screen = pygame.display.set_mode((game.GAME_WIDTH, game.GAME_HEIGHT))
+    game.level = level
+    game.load_level()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # Saves go through the editors journal, pointed at a scratch level file
+        game.journal.open(os.path.join(directory, "level.csv"), game.world_data)
+        for name, function, repeat in BENCHMARKS:
+            # Messages the game prints, like "loading level", arent timed to the terminal
+            samples = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                function(game)  # warm up
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    function(game)
+                    samples.append(time.perf_counter() - start)
+            results[name] = summarize(samples)
+            print(f"{name:32} {results[name]['mean_us']:10.1f} us")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["gameplay.frame"] = summarize(gameplay_loop(game, frames))
+    frame = results["gameplay.frame"]
+    print(f"{'gameplay.frame':32} p50 {frame['p50_us']:.1f} us  p95 {frame['p95_us']:.1f} us  p99 {frame['p99_us']:.1f} us")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """list benchmarks whose median got slower than the baseline by more than threshold"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["p50_us"]
+        after = result["p50_us"]
+        if before > 0 and (after - before) / before > threshold:
+            regressions.append((name, before, after))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", type=int, default=0) # level to benchmark on
+    parser.add_argument("--frames", type=int, default=2000) # frames in the gameplay loop
+    parser.add_argument("--output", default="benchmark_results.json") # where to write results
+    parser.add_argument("--baseline", default="benchmark_baseline.json") # results to compare with
+    parser.add_argument("--threshold", type=float, default=0.10) # allowed slowdown, 0.10 is 10%
+    parser.add_argument("--save-baseline", action="store_true") # store results as the baseline
+
+    args = parser.parse_args()
+
+    results = run(args.level, args.frames)
+    report = {
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved baseline to {args.baseline}")
+        sys.exit()
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save-baseline to create one")
+        sys.exit()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, before, after in regressions:
+        print(f"REGRESSION {name}: {before:.1f} us -> {after:.1f} us ({(after - before) / before:+.0%})")
+    if regressions:
+        sys.exit(1)
+    print("no regressions")
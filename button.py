@@ -8,24 +8,7 @@ class Button():
 		self.image = pygame.transform.scale(image, (int(width * scale), int(height * scale)))
 		self.rect = self.image.get_rect()
 		self.rect.topleft = (x, y)
-		self.clicked = False
 
 	def draw(self, surface):
-		action = False
-
-		#get mouse position
-		pos = pygame.mouse.get_pos()
-
-		#check mouseover and clicked conditions
-		if self.rect.collidepoint(pos):
-			if pygame.mouse.get_pressed()[0] == 1 and self.clicked == False:
-				action = True
-				self.clicked = True
-
-		if pygame.mouse.get_pressed()[0] == 0:
-			self.clicked = False
-
-		#draw button
+		#draw button, clicks are found from mouse events by the caller
 		surface.blit(self.image, (self.rect.x, self.rect.y))
-
-		return action
\ No newline at end of file
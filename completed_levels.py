@@ -1 +0,0 @@
-completed_levels = []
@@ -0,0 +1,242 @@
+"""Moving platforms, patrolling hazards and projectiles
+
+The entities of a level are listed in levelN_entities.json next to the level file:
+
+    {"entities": [
+        {"kind": "platform", "x": 10, "y": 12, "width": 3, "dx": 1, "distance": 6},
+        {"kind": "hazard", "x": 4, "y": 15, "dx": 2, "distance": 5},
+        {"kind": "projectile", "x": 29, "y": 14, "dx": -4, "distance": 20}
+    ]}
+
+x, y, width and distance are in tiles, dx and dy in pixels per frame. Platforms and hazards go
+back and forth over their distance, projectiles fly their distance and are fired again from
+where they started. Platforms can be jumped onto from below and carry the player standing on them.
+"""
+import json
+import os
+import numpy as np
+import pygame
+import tiles
+
+# Kinds as (name, tile drawn, deadly, carries the player, fired again instead of turning back)
+KINDS = [
+    ("platform", 2, False, True, False),
+    ("hazard", 8, True, False, False),
+    ("projectile", 4, True, False, True),
+]
+KIND_NAMES = [kind[0] for kind in KINDS]
+
+# Size in pixels of the cells in the grid index used to find entities near the player
+CELL_SIZE = 64
+
+
+class EntityError(Exception):
+    """entity file has something we cant use"""
+
+
+def entities_path(level, directory="./levels"):
+    """path to the entity file of a level"""
+    return os.path.join(directory, f"level{level}_entities.json")
+
+
+def load(level, TILE_SIZE=32, tile_list=None, directory="./levels"):
+    """entities of a level, None when the level has none, raises EntityError for a broken file"""
+    path = entities_path(level, directory)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            entities = json.load(f).get("entities", [])
+        if not entities:
+            return None
+        return EntityStore(entities, TILE_SIZE, tile_list)
+    except KeyError as error:
+        raise EntityError(f"{path}: an entity has no {error}") from error
+    except (ValueError, TypeError, AttributeError) as error:
+        raise EntityError(f"{path}: {error}") from error
+
+
+class EntityStore:
+    """Every entity of a level kept in parallel arrays, updated and drawn in batches
+
+    A grid index sorted by cell is rebuilt after every update, so finding the entities near
+    the player looks at a few cells however many entities the level has"""
+    __slots__ = (
+        "TILE_SIZE", "count", "kind", "width", "height", "deadly", "platform", "repeat",
+        "hit_left", "hit_top", "hit_width", "hit_height", "start_x", "start_y", "start_dx", "start_dy",
+        "x", "y", "previous_x", "previous_y", "dx", "dy", "speed", "distance", "travelled",
+        "max_width", "max_height", "cell", "order", "sorted_cells", "grid_cols",
+        "images", "riding", "player_bottom",
+    )
+
+    def __init__(self, entities, TILE_SIZE=32, tile_list=None):
+        self.TILE_SIZE = TILE_SIZE
+        self.count = len(entities)
+        tile_types = tiles.load()
+
+        kind, x, y, width, dx, dy, distance, hitboxes = [], [], [], [], [], [], [], []
+        for index, entity in enumerate(entities):
+            if entity.get("kind") not in KIND_NAMES:
+                raise EntityError(f"entity {index}: unknown kind {entity.get('kind')!r}")
+            kind_id = KIND_NAMES.index(entity["kind"])
+            size = int(entity.get("width", 1))
+            kind.append(kind_id)
+            x.append(entity["x"] * TILE_SIZE)
+            y.append(entity["y"] * TILE_SIZE)
+            width.append(size * TILE_SIZE)
+            dx.append(entity.get("dx", 0))
+            dy.append(entity.get("dy", 0))
+            distance.append(entity.get("distance", 0) * TILE_SIZE)
+
+            # Hazards use the hitbox of the tile they look like, stretched over their width
+            left, top, hit_width, hit_height = tile_types.hitboxes[KINDS[kind_id][1]]
+            hitboxes.append((left * TILE_SIZE, top * TILE_SIZE, (size - 1 + hit_width) * TILE_SIZE, hit_height * TILE_SIZE))
+
+        self.kind = np.array(kind, dtype=np.int8)
+        self.width = np.array(width, dtype=np.int32)
+        self.height = np.full(self.count, TILE_SIZE, dtype=np.int32)
+        self.deadly = np.array([KINDS[k][2] for k in kind], dtype=bool)
+        self.platform = np.array([KINDS[k][3] for k in kind], dtype=bool)
+        self.repeat = np.array([KINDS[k][4] for k in kind], dtype=bool)
+        self.hit_left, self.hit_top, self.hit_width, self.hit_height = np.array(hitboxes, dtype=float).reshape(-1, 4).T
+
+        self.start_x = np.array(x, dtype=float)
+        self.start_y = np.array(y, dtype=float)
+        self.start_dx = np.array(dx, dtype=float)
+        self.start_dy = np.array(dy, dtype=float)
+        self.speed = np.hypot(self.start_dx, self.start_dy)
+        self.distance = np.array(distance, dtype=float)
+        self.max_width = int(self.width.max(initial=0))
+        self.max_height = int(self.height.max(initial=0))
+
+        # Entities look the same for their whole life, one image per kind and width is shared
+        self.images = None
+        if tile_list is not None:
+            shared = {}
+            self.images = []
+            for kind_id, size in zip(kind, width):
+                if (kind_id, size) not in shared:
+                    image = pygame.Surface((size, TILE_SIZE), pygame.SRCALPHA)
+                    for offset in range(0, size, TILE_SIZE):
+                        image.blit(tile_list[KINDS[kind_id][1]], (offset, 0))
+                    shared[(kind_id, size)] = image.convert_alpha() if pygame.display.get_surface() else image
+                self.images.append(shared[(kind_id, size)])
+
+        self.reset()
+
+    def __len__(self):
+        return self.count
+
+    def reset(self):
+        """put every entity back where the level starts it"""
+        self.x = self.start_x.copy()
+        self.y = self.start_y.copy()
+        self.previous_x = self.x.copy()
+        self.previous_y = self.y.copy()
+        self.dx = self.start_dx.copy()
+        self.dy = self.start_dy.copy()
+        self.travelled = np.zeros(self.count)
+        self.riding = None
+        self.player_bottom = None
+        self.build_index()
+
+    def build_index(self):
+        """sort the entities by the grid cell of their top left corner"""
+        cols = np.floor_divide(self.x, CELL_SIZE).astype(np.int64)
+        rows = np.floor_divide(self.y, CELL_SIZE).astype(np.int64)
+        self.grid_cols = int(cols.max(initial=0)) + 1
+        self.cell = np.maximum(rows, 0) * self.grid_cols + np.clip(cols, 0, None)
+        self.order = np.argsort(self.cell, kind="stable")
+        self.sorted_cells = self.cell[self.order]
+
+    def near(self, rect):
+        """indices of the entities that could overlap a rect, from the grid index"""
+        # An entity is indexed by its top left corner, so look far enough up and left to catch big ones,
+        # and include entities just touching the rect, like a platform right under the player.
+        # Entities left of or above the world are indexed in the first cells, so are rects
+        first_col = max((rect.left - self.max_width) // CELL_SIZE, 0)
+        last_col = max(min(rect.right // CELL_SIZE, self.grid_cols - 1), 0)
+        first_row = max((rect.top - self.max_height) // CELL_SIZE, 0)
+        last_row = max(rect.bottom // CELL_SIZE, 0)
+        if last_col < first_col or last_row < first_row:
+            return np.empty(0, dtype=np.int64)
+
+        rows = np.arange(first_row, last_row + 1) * self.grid_cols
+        starts = np.searchsorted(self.sorted_cells, rows + first_col, "left")
+        ends = np.searchsorted(self.sorted_cells, rows + last_col, "right")
+        return np.concatenate([self.order[start:end] for start, end in zip(starts, ends)])
+
+    def update(self, physics=None):
+        """move every entity one frame, a player standing on a platform moves with it"""
+        self.previous_x, self.previous_y = self.x, self.y
+        self.x = self.x + self.dx
+        self.y = self.y + self.dy
+        self.travelled += self.speed
+
+        # At the end of their distance platforms and hazards turn back, projectiles are fired again
+        done = (self.travelled >= self.distance) & (self.speed > 0)
+        turn = done & ~self.repeat
+        self.dx = np.where(turn, -self.dx, self.dx)
+        self.dy = np.where(turn, -self.dy, self.dy)
+        fire = done & self.repeat
+        self.x = np.where(fire, self.start_x, self.x)
+        self.y = np.where(fire, self.start_y, self.y)
+        self.previous_x = np.where(fire, self.start_x, self.previous_x)
+        self.previous_y = np.where(fire, self.start_y, self.previous_y)
+        self.travelled = np.where(done, self.travelled - self.distance, self.travelled)
+        self.travelled = np.where(fire, 0.0, self.travelled)
+        self.build_index()
+
+        if physics is None:
+            return
+        if self.riding is not None and not physics.dead:
+            physics.pos.x += self.x[self.riding] - self.previous_x[self.riding]
+            physics.pos.y += self.y[self.riding] - self.previous_y[self.riding]
+            physics.rect.topleft = physics.pos
+        self.riding = None
+        self.player_bottom = physics.rect.bottom
+
+    def collide(self, physics):
+        """hazards and projectiles kill the player, platforms catch a player falling onto them"""
+        if physics.dead:
+            return
+        rect = physics.rect
+        near = self.near(rect)
+        if not len(near):
+            return
+
+        left = self.x[near] + self.hit_left[near]
+        top = self.y[near] + self.hit_top[near]
+        right = left + self.hit_width[near]
+        bottom = top + self.hit_height[near]
+        across = (rect.left < right) & (rect.right > left)
+        overlap = across & (rect.top < bottom) & (rect.bottom > top)
+
+        if (overlap & self.deadly[near]).any():
+            physics.dead = True
+
+        # Platforms only stop a player coming from above, they can be jumped through from below
+        if self.player_bottom is None or physics.vel.y < 0:
+            return
+        was_above = self.player_bottom <= self.previous_y[near] + self.hit_top[near] + np.abs(self.dy[near])
+        landing = self.platform[near] & across & was_above & (rect.bottom >= top)
+        if landing.any():
+            index = np.argmax(landing)
+            rect.bottom = int(top[index])
+            physics.pos.y = rect.y
+            physics.vel.y = 0
+            physics.grounded = True
+            physics.is_jumping = False
+            self.riding = int(near[index])
+
+    def draw(self, surface, offset=(0, 0), alpha=1):
+        """draw the entities in view between their last two positions, returns the rects drawn"""
+        x = self.previous_x + (self.x - self.previous_x) * alpha + offset[0]
+        y = self.previous_y + (self.y - self.previous_y) * alpha + offset[1]
+        width, height = surface.get_size()
+        visible = np.flatnonzero((x < width) & (x + self.width > 0) & (y < height) & (y + self.height > 0))
+
+        positions = list(zip(np.round(x[visible]).astype(int).tolist(), np.round(y[visible]).astype(int).tolist()))
+        images = self.images
+        surface.fblits([(images[index], position) for index, position in zip(visible.tolist(), positions)])
+        return [images[index].get_rect(topleft=position) for index, position in zip(visible.tolist(), positions)]
@@ -0,0 +1,224 @@
+"""Edit journal for the level editor, every tile change is kept as (x, y, old, new)
+
+Changes are appended to a small log next to the level on a timer, so saving costs the same
+however big the level is and a crash loses at most one autosave interval. Now and then the
+log is compacted into the level file. The log is a header followed by fixed size records:
+
+    magic     4 bytes  b"KKEJ"
+    version   uint8
+    padding   3 bytes
+    changes   (x uint16, y uint16, old int16, new int16) in the order they were made
+
+Undo and redo are written as the changes they make, so replaying the log always gives the
+current level.
+"""
+import os
+import struct
+import level_format
+
+MAGIC = b"KKEJ"
+VERSION = 1
+HEADER = struct.Struct("<4sB3x")
+CHANGE = struct.Struct("<HHhh")
+EXTENSION = ".journal"
+
+# Milliseconds between appending changes to the log
+AUTOSAVE_INTERVAL = 2000
+
+# Changes in the log before it is written into the level file
+COMPACT_AFTER = 1000
+
+# Added to the name of a log that cant be recovered when it is moved out of the way
+BROKEN_EXTENSION = ".broken"
+
+
+class JournalError(Exception):
+    """journal log is not in a format we can read"""
+
+
+def journal_path(level_path):
+    """path to the journal log of a level file"""
+    return level_path + EXTENSION
+
+
+def whole_records_size(size):
+    """bytes at the start of a log of this size holding the header and whole records"""
+    if size < HEADER.size:
+        return 0
+    return HEADER.size + (size - HEADER.size) // CHANGE.size * CHANGE.size
+
+
+def read_journal(path):
+    """changes in a journal log, a record cut short by a crash is ignored"""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        return []
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise JournalError(f"{path}: not an edit journal")
+    if version > VERSION:
+        raise JournalError(f"{path}: format version {version} is newer than {VERSION}")
+
+    end = whole_records_size(len(data))
+    return list(CHANGE.iter_unpack(data[HEADER.size:end]))
+
+
+def apply_changes(world_data, changes, reverse=False):
+    """write changes into the TileMap, or their old values in reverse order for undo"""
+    if reverse:
+        for x, y, old, new in reversed(changes):
+            world_data.set(x, y, old)
+    else:
+        for x, y, old, new in changes:
+            world_data.set(x, y, new)
+
+
+class EditJournal:
+    """Records the tile changes made in the editor and keeps them safe on disk
+
+    Changes are grouped into strokes, one per click or drag, and undo and redo work on whole strokes"""
+    def __init__(self, compact_after=COMPACT_AFTER):
+        self.compact_after = compact_after
+        self.level_path = None
+        self.log_path = None
+
+        self.undo_stack = []
+        self.redo_stack = []
+        self.stroke = None
+
+        # Changes not yet appended to the log, and how many the log holds
+        self.pending = []
+        self.logged = 0
+
+    def open(self, level_path, world_data):
+        """start journaling a level, changes left in its log by a crash are applied to world_data
+
+        Returns how many changes were recovered. With level_path None changes can be undone but arent saved.
+        Raises JournalError, without changing world_data, when the log cant be recovered"""
+        self.level_path = level_path
+        self.log_path = journal_path(level_path) if level_path is not None else None
+        self.undo_stack = []
+        self.redo_stack = []
+        self.stroke = None
+        self.pending = []
+        self.logged = 0
+
+        changes = []
+        if self.log_path is not None and os.path.exists(self.log_path):
+            changes = read_journal(self.log_path)
+
+            # A record cut short by a crash is cut off, or the next changes would be appended out of step
+            size = os.path.getsize(self.log_path)
+            if whole_records_size(size) != size:
+                os.truncate(self.log_path, whole_records_size(size))
+
+        for x, y, old, new in changes:
+            if not (0 <= x < len(world_data[0]) and 0 <= y < len(world_data)):
+                raise JournalError(f"{self.log_path}: change to cell ({x}, {y}) is outside the level")
+        apply_changes(world_data, changes)
+        self.logged = len(changes)
+        return len(changes)
+
+    @property
+    def dirty(self):
+        """True when the level file is behind the edits"""
+        return bool(self.pending or self.logged)
+
+    def record(self, x, y, old, new):
+        """add one tile change to the current stroke"""
+        if self.stroke is None:
+            self.stroke = []
+            self.undo_stack.append(self.stroke)
+            self.redo_stack = []
+        change = (x, y, old, new)
+        self.stroke.append(change)
+        self.pending.append(change)
+
+    def end_stroke(self):
+        """the next change starts a new stroke"""
+        self.stroke = None
+
+    def undo(self, world_data):
+        """take back the last stroke, returns the changes it undid"""
+        self.end_stroke()
+        if not self.undo_stack:
+            return []
+        stroke = self.undo_stack.pop()
+        self.redo_stack.append(stroke)
+        apply_changes(world_data, stroke, reverse=True)
+        self.pending.extend((x, y, new, old) for x, y, old, new in reversed(stroke))
+        return stroke
+
+    def redo(self, world_data):
+        """make the last undone stroke again, returns its changes"""
+        self.end_stroke()
+        if not self.redo_stack:
+            return []
+        stroke = self.redo_stack.pop()
+        self.undo_stack.append(stroke)
+        apply_changes(world_data, stroke)
+        self.pending.extend(stroke)
+        return stroke
+
+    def flush(self):
+        """append the pending changes to the log"""
+        if not self.pending or self.log_path is None:
+            return 0
+
+        with open(self.log_path, "ab") as f:
+            if f.tell() == 0:
+                f.write(HEADER.pack(MAGIC, VERSION))
+            f.write(b"".join(CHANGE.pack(*change) for change in self.pending))
+            f.flush()
+            os.fsync(f.fileno())
+
+        count = len(self.pending)
+        self.logged += count
+        self.pending = []
+        return count
+
+    def autosave(self, world_data, tileset):
+        """flush pending changes and compact once the log has grown large, returns True when compacted"""
+        self.flush()
+        if self.logged >= self.compact_after:
+            return self.compact(world_data, tileset)
+        return False
+
+    def compact(self, world_data, tileset, force=False):
+        """write the whole level file and empty the log, the level file is replaced atomically
+
+        Without force nothing is written when the level file already holds every edit"""
+        if self.level_path is None or not (self.dirty or force):
+            return False
+
+        level_format.write_level(self.level_path, world_data, tileset)
+
+        # Replaying the log over the new file would change nothing, so a crash here is harmless
+        try:
+            os.remove(self.log_path)
+        except FileNotFoundError:
+            pass
+        self.pending = []
+        self.logged = 0
+        return True
+
+    def move_aside(self):
+        """rename a log that cant be recovered so the level opens without it, returns its new path"""
+        broken_path = self.log_path + BROKEN_EXTENSION
+        os.replace(self.log_path, broken_path)
+        return broken_path
+
+    def discard(self):
+        """forget every change that isnt in the level file yet"""
+        if self.log_path is not None:
+            try:
+                os.remove(self.log_path)
+            except FileNotFoundError:
+                pass
+        self.undo_stack = []
+        self.redo_stack = []
+        self.stroke = None
+        self.pending = []
+        self.logged = 0
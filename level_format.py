@@ -0,0 +1,273 @@
+"""Level files, CSV and a compact binary format
+
+The binary format is a 12 byte header followed by the tile grid packed one byte per tile:
+
+    magic     4 bytes  b"KKLV"
+    version   uint8
+    tileset   uint8    id of the tile set the level was made with
+    cell      uint8    CELL_INT8 (empty is -1) or CELL_UINT8 (empty is 255) for more than 127 tile types
+    padding   1 byte
+    rows      uint16
+    cols      uint16
+
+Levels larger than one screen can be stored chunked, as fixed size square chunks that are read
+one at a time when the camera gets near them:
+
+    magic       4 bytes  b"KKLC"
+    version     uint8
+    tileset     uint8
+    cell        uint8
+    chunk size  uint8    tiles per chunk side
+    rows        uint32
+    cols        uint32
+    chunks      chunk size * chunk size bytes each, row by row of chunks, empty past the level edge
+
+Convert the existing CSV levels with `python level_format.py levels/` (or back with --to-csv,
+or to chunked levels with --chunked).
+"""
+import array
+import csv
+import io
+import mmap
+import os
+import re
+import struct
+from atomic import atomic_write
+from tilemap import TileMap
+
+MAGIC = b"KKLV"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBxHH")
+
+CELL_INT8 = 0
+CELL_UINT8 = 1
+UINT8_EMPTY = 255
+
+CHUNKED_MAGIC = b"KKLC"
+CHUNKED_HEADER = struct.Struct("<4sBBBBII")
+CHUNK_SIZE = 16
+
+CSV_EXTENSION = ".csv"
+BINARY_EXTENSION = ".lvl"
+CHUNKED_EXTENSION = ".lvc"
+
+LEVEL_NAME = re.compile(r"level(\d+)_data\.(csv|lvl|lvc)$")
+
+
+class LevelFormatError(Exception):
+    """level file is not in a format we can read"""
+
+
+def read_csv(path):
+    """read a CSV level into a TileMap"""
+    with open(path, newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter = ',')
+        return TileMap.from_rows([int(tile) for tile in row] for row in reader)
+
+
+def write_csv(path, world_data):
+    """write a TileMap or a list of rows to a CSV level"""
+    csvfile = io.StringIO(newline='')
+    writer = csv.writer(csvfile, delimiter = ',')
+    for row in world_data:
+        writer.writerow(row)
+    atomic_write(path, csvfile.getvalue())
+
+
+def read_binary(path):
+    """read a binary level with mmap, returns (TileMap, tileset)"""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if len(data) < HEADER.size:
+                raise LevelFormatError(f"{path}: file is too short")
+
+            magic, version, tileset, cell, rows, cols = HEADER.unpack_from(data)
+            if magic != MAGIC:
+                raise LevelFormatError(f"{path}: not a level file")
+            if version > VERSION:
+                raise LevelFormatError(f"{path}: format version {version} is newer than {VERSION}")
+            if len(data) < HEADER.size + rows * cols:
+                raise LevelFormatError(f"{path}: tile data is truncated")
+
+            tiles = data[HEADER.size:HEADER.size + rows * cols]
+
+    # More tile types than fit in a signed byte are kept two bytes per tile in memory
+    return TileMap.from_bytes(cols, rows, tiles, unsigned=cell == CELL_UINT8), tileset
+
+
+def write_binary(path, world_data, tileset=0):
+    """write a TileMap or a list of rows to a binary level"""
+    rows = len(world_data)
+    cols = len(world_data[0]) if rows else 0
+    if isinstance(world_data, TileMap):
+        cell, data = pack_cells(world_data.tiles)
+    else:
+        cell, data = pack_cells([tile for row in world_data for tile in row])
+
+    atomic_write(path, HEADER.pack(MAGIC, VERSION, tileset, cell, rows, cols) + data)
+
+
+def pack_cells(tiles):
+    """pack tiles one byte each, returns (cell format, bytes)"""
+    highest = max(tiles, default=-1)
+    if highest <= 127:
+        return CELL_INT8, array.array("b", tiles).tobytes()
+    if highest < UINT8_EMPTY:
+        return CELL_UINT8, array.array("B", [UINT8_EMPTY if tile < 0 else tile for tile in tiles]).tobytes()
+    raise LevelFormatError(f"tile {highest} does not fit in one byte")
+
+
+def write_chunked(path, world_data, tileset=0, chunk_size=CHUNK_SIZE):
+    """write a TileMap or a list of rows to a chunked level"""
+    rows = len(world_data)
+    cols = len(world_data[0]) if rows else 0
+    chunks_x = -(-cols // chunk_size)
+    chunks_y = -(-rows // chunk_size)
+
+    tiles = []
+    for cy in range(chunks_y):
+        for cx in range(chunks_x):
+            for y in range(cy * chunk_size, (cy + 1) * chunk_size):
+                row = world_data[y] if y < rows else []
+                chunk_row = row[cx * chunk_size:(cx + 1) * chunk_size]
+                tiles.extend(chunk_row)
+                tiles.extend([-1] * (chunk_size - len(chunk_row)))
+    cell, data = pack_cells(tiles)
+
+    atomic_write(path, CHUNKED_HEADER.pack(CHUNKED_MAGIC, VERSION, tileset, cell, chunk_size, rows, cols) + data)
+
+
+class ChunkedFile:
+    """Chunked level opened with mmap, chunks are read one at a time"""
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise LevelFormatError(f"{path}: file is empty")
+
+        if len(self.data) < CHUNKED_HEADER.size:
+            self.close()
+            raise LevelFormatError(f"{path}: file is too short")
+        magic, version, self.tileset, self.cell, self.chunk_size, self.rows, self.cols = \
+            CHUNKED_HEADER.unpack_from(self.data)
+        if magic != CHUNKED_MAGIC:
+            self.close()
+            raise LevelFormatError(f"{path}: not a chunked level file")
+        if version > VERSION:
+            self.close()
+            raise LevelFormatError(f"{path}: format version {version} is newer than {VERSION}")
+
+        self.chunks_x = -(-self.cols // self.chunk_size)
+        self.chunks_y = -(-self.rows // self.chunk_size)
+        if len(self.data) < CHUNKED_HEADER.size + self.chunks_x * self.chunks_y * self.chunk_size ** 2:
+            self.close()
+            raise LevelFormatError(f"{path}: tile data is truncated")
+
+    def read_chunk(self, cx, cy):
+        """tiles of one chunk as a list of rows, chunks outside the level are empty"""
+        size = self.chunk_size
+        if not (0 <= cx < self.chunks_x and 0 <= cy < self.chunks_y):
+            return [[-1] * size for _ in range(size)]
+
+        start = CHUNKED_HEADER.size + (cy * self.chunks_x + cx) * size * size
+        grid = array.array("b" if self.cell == CELL_INT8 else "B")
+        grid.frombytes(self.data[start:start + size * size])
+        chunk = [grid[y * size:(y + 1) * size].tolist() for y in range(size)]
+        if self.cell == CELL_UINT8:
+            chunk = [[-1 if tile == UINT8_EMPTY else tile for tile in row] for row in chunk]
+        return chunk
+
+    def read_all(self):
+        """every tile of the level as a list of rows"""
+        size = self.chunk_size
+        world_data = [[] for _ in range(self.chunks_y * size)]
+        for cy in range(self.chunks_y):
+            for cx in range(self.chunks_x):
+                for y, row in enumerate(self.read_chunk(cx, cy)):
+                    world_data[cy * size + y].extend(row)
+        return [row[:self.cols] for row in world_data[:self.rows]]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def read_level(path):
+    """read a level file of any format, returns (TileMap, tileset)"""
+    if path.endswith(BINARY_EXTENSION):
+        return read_binary(path)
+    if path.endswith(CHUNKED_EXTENSION):
+        chunked = ChunkedFile(path)
+        try:
+            return TileMap.from_rows(chunked.read_all(), chunked.cols), chunked.tileset
+        finally:
+            chunked.close()
+    return read_csv(path), 0
+
+
+def write_level(path, world_data, tileset=0):
+    """write a level file in the format given by the extension, the old file is replaced atomically"""
+    if path.endswith(BINARY_EXTENSION):
+        write_binary(path, world_data, tileset)
+    elif path.endswith(CHUNKED_EXTENSION):
+        write_chunked(path, world_data, tileset)
+    else:
+        write_csv(path, world_data)
+
+
+def level_path(level, directory="./levels"):
+    """path to a level, a chunked or binary file is used when it exists"""
+    for extension in (CHUNKED_EXTENSION, BINARY_EXTENSION):
+        path = os.path.join(directory, f"level{level}_data{extension}")
+        if os.path.exists(path):
+            return path
+    return os.path.join(directory, f"level{level}_data{CSV_EXTENSION}")
+
+
+def list_levels(directory="./levels"):
+    """sorted level numbers in a directory, counting each level once whatever its format"""
+    levels = set()
+    for filename in os.listdir(directory):
+        match = LEVEL_NAME.match(filename)
+        if match:
+            levels.add(int(match.group(1)))
+    return sorted(levels)
+
+
+def convert(path, extension):
+    """convert one level file to the format of an extension, returns the new path"""
+    world_data, tileset = read_level(path)
+    new_path = os.path.splitext(path)[0] + extension
+    write_level(new_path, world_data, tileset)
+    return new_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+") # level files or directories of levels
+    parser.add_argument("--to-csv", action="store_true") # convert binary levels back to CSV
+    parser.add_argument("--chunked", action="store_true") # convert CSV levels to chunked levels
+
+    args = parser.parse_args()
+
+    if args.to_csv:
+        source_extensions, extension = (BINARY_EXTENSION, CHUNKED_EXTENSION), CSV_EXTENSION
+    elif args.chunked:
+        source_extensions, extension = (CSV_EXTENSION,), CHUNKED_EXTENSION
+    else:
+        source_extensions, extension = (CSV_EXTENSION,), BINARY_EXTENSION
+
+    for path in args.paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(source_extensions)]
+        else:
+            files = [path]
+
+        for file in files:
+            new_path = convert(file, extension)
+            print(f"{file} -> {new_path} ({os.path.getsize(file)} -> {os.path.getsize(new_path)} bytes)")
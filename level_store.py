@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import level_format
+
+# Seconds between checks of the level files for changes made outside the game
+POLL_INTERVAL = 0.5
+
+class LevelStore:
+    """Keeps parsed levels in an LRU cache that is invalidated when the file changes"""
+    def __init__(self, directory="./levels", capacity=8):
+        self.directory = directory
+        self.capacity = capacity
+
+        # level -> (path, file state, world_data, tileset), least recently used first
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Levels being read in the background
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def file_state(self, level):
+        """path to a level file and its modification time and size"""
+        path = level_format.level_path(level, self.directory)
+        stat = os.stat(path)
+        return path, (stat.st_mtime_ns, stat.st_size)
+
+    def cached(self, level):
+        """cache entry for a level if it is still up to date with the file"""
+        with self.lock:
+            entry = self.cache.get(level)
+        if entry is None:
+            return None
+
+        try:
+            path, state = self.file_state(level)
+        except FileNotFoundError:
+            return None
+        if entry[0] != path or entry[1] != state:
+            return None
+
+        with self.lock:
+            if level in self.cache:
+                self.cache.move_to_end(level)
+        return entry
+
+    def read(self, level):
+        """read a level from disk into the cache"""
+        path, state = self.file_state(level)
+        world_data, tileset = level_format.read_level(path)
+        entry = (path, state, world_data, tileset)
+
+        with self.lock:
+            self.cache[level] = entry
+            self.cache.move_to_end(level)
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+        return entry
+
+    def get(self, level):
+        """copy of a levels tiles and its tile set id, raises FileNotFoundError for missing levels"""
+        entry = self.cached(level)
+        if entry is None:
+            # Wait for a background read of this level instead of reading it twice
+            with self.lock:
+                future = self.pending.pop(level, None)
+            if future is not None:
+                try:
+                    future.result()
+                except (OSError, level_format.LevelFormatError):
+                    pass
+                entry = self.cached(level)
+
+        if entry is None:
+            entry = self.read(level)
+
+        return entry[2].copy(), entry[3]
+
+    def prefetch(self, level):
+        """start reading a level in the background so a later get doesnt wait on disk"""
+        if self.cached(level) is not None:
+            return
+
+        with self.lock:
+            future = self.pending.get(level)
+            if future is not None and not future.done():
+                return
+            self.pending[level] = self.executor.submit(self.read, level)
+
+    def invalidate(self, level):
+        """drop a level from the cache, used after saving it"""
+        with self.lock:
+            self.cache.pop(level, None)
+
+
+class LevelWatcher:
+    """Notices level files changed outside the game by polling their modification times
+
+    Only the directory listing is read on a poll, the levels that changed are left to the
+    caller to parse"""
+    def __init__(self, directory="./levels", interval=POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.states = self.scan()
+        self.last_poll = time.monotonic()
+
+    def scan(self):
+        """modification time and size of every level file by file name"""
+        states = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if level_format.LEVEL_NAME.match(entry.name):
+                        stat = entry.stat()
+                        states[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+        return states
+
+    def poll(self):
+        """levels with a file added, changed or removed since the last poll, checked at most once per interval"""
+        now = time.monotonic()
+        if now - self.last_poll < self.interval:
+            return set()
+        self.last_poll = now
+
+        states = self.scan()
+        changed = {
+            int(level_format.LEVEL_NAME.match(name).group(1))
+            for name in states.keys() | self.states.keys()
+            if states.get(name) != self.states.get(name)
+        }
+        self.states = states
+        return changed
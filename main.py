@@ -1,21 +1,43 @@
 import pygame
+import os
 import sys
 import button
-import csv
-import os
+import assets
 import argparse
+import atexit
+import time
+from concurrent.futures import ProcessPoolExecutor
 from player import Player
+from simulation import inputs_from_keys, FPS
 import scenes
-from completed_levels import completed_levels
+import text_cache
+import tiles
+import replay
+import level_format
+import journal
+import palette
+import entities
+import reachability
+from level_store import LevelStore, LevelWatcher
+from profiler import FrameProfiler, NullProfiler
+from world import Camera, ChunkedWorld
+from tilemap import TileMap, typecode_for
+from progress import ProgressStore
+from timestep import FixedTimestep, FramePacer
 
 class Game:
     """Definitive game class"""
-    def __init__(self, scene):
+    def __init__(self, scene, dirty_rects=False, profiler=None, pacer=None, vsync=False):
         pygame.init()
 
         # Clock settings
         self.clock = pygame.time.Clock()
-        self.FPS = 60
+        self.FPS = FPS
+
+        # Gameplay is simulated in fixed steps, drawn frames are paced separately
+        self.timestep = FixedTimestep(self.FPS)
+        self.pacer = pacer or FramePacer(self.FPS)
+        self.vsync = vsync
 
         # Screen settings
         self.GAME_WIDTH = 960
@@ -28,28 +50,62 @@ class Game:
 
         # Game variables
         self.level = 0
+        self.tileset = 0
+
+        # Parsed levels, cached so scene changes dont wait on the disk
+        self.levels = LevelStore()
+
+        # Level files edited outside the game, in a text editor or a second editor window, are
+        # picked up while playing. level_file_tiles is what the file held when last read or written
+        self.level_watcher = LevelWatcher(self.levels.directory)
+        self.level_file_tiles = None
+
+        # Tile changes made in the editor, autosaved as deltas and used for undo/redo
+        self.journal = journal.EditJournal()
+        self.last_autosave = 0
 
-        # Get current scene from argument
+        # Saved levels are checked for reachable goals in a worker process, so the editor doesnt stall
+        self.analyzer = None
+        self.analysis = None
+
+        # Name of the first scene, taken from argument
         self.scene = scene
 
+        # Dirty rect mode only sends the regions that changed to the display
+        self.dirty_rect_mode = dirty_rects
+        self.dirty_rects = []
+        self.dirty_cells = []
+        self.full_redraw = True
+        self.player_dirty_rect = None
+
+        # Levels bigger than the screen are streamed in chunks and followed by the camera
+        self.allow_chunked = False
+        self.chunked_world = None
+        self.camera = Camera(self.GAME_WIDTH, self.GAME_HEIGHT)
+
+        # Moving platforms, hazards and projectiles of the level, None when it has none
+        self.entities = None
+        self.entity_rects = []
+
+        # Frame profiler, does nothing unless the game runs with --profile
+        self.profiler = profiler or NullProfiler()
+        self.overlay_rect = None
+
         # Tiling settings
         self.TILE_SIZE = 32
         self.ROWS = self.GAME_HEIGHT // self.TILE_SIZE + 1
         self.COLS = self.GAME_WIDTH // self.TILE_SIZE
 
-        self.TILE_TYPES = len(os.listdir("./assets/images/tiles/"))
+        # Tile types and their images come from the tile manifest
+        self.tile_types = tiles.load()
+        self.TILE_TYPES = len(self.tile_types)
 
         self.current_tile = 0
 
 
         # Load images
-        self.tile_list = []
-
-        # Load every tile from path to tile list
-        for i in range(self.TILE_TYPES):
-            img = pygame.image.load(f"./assets/images/tiles/{i}.png").convert_alpha()
-            img = pygame.transform.scale(img, (self.TILE_SIZE, self.TILE_SIZE))
-            self.tile_list.append(img)
+        # Load every tile from path to tile list, packed into one cached atlas
+        self.tile_list = assets.load_atlas("tiles", self.tile_types.images, size=(self.TILE_SIZE, self.TILE_SIZE))
 
         # Static images
         self.save_img = pygame.image.load("./assets/images/UI/save_btn.png").convert_alpha()
@@ -65,29 +121,26 @@ class Game:
         self.GREY = (189, 189, 189)
 
         # Define font
-        self.font = pygame.font.Font(None, 30)
+        self.font = text_cache.font(None, 30)
+
+        # Cached background and tiles, rebuilt by build_static_layer on level load
+        self.show_grid = False
+        self.background_layer = None
+        self.static_layer = None
+
+        # World building, the static layer follows every change to the tiles
+        self.world_data = TileMap(self.COLS, self.ROWS, typecode=typecode_for(self.TILE_TYPES - 1))
+        self.world_data.subscribe(self.tiles_changed)
 
-        # World building
-        self.world_data = []
-        for row in range(self.ROWS):
-            r = [-1] * self.COLS
-            self.world_data.append(r)
+        # Changes to more tiles than this render the whole static layer again instead of cell by cell
+        self.STATIC_REBUILD_CELLS = 64
 
         # create buttons
         self.save_button = button.Button(self.GAME_WIDTH // 2, self.GAME_HEIGHT + self.LOWER_MARGIN - 50, self.save_img, 1)
         self.load_button = button.Button(self.GAME_WIDTH // 2 + 200, self.GAME_HEIGHT + self.LOWER_MARGIN - 50, self.load_img, 1)
 
-        # make a tile button list
-        self.button_list = []
-        self.button_col = 0
-        self.button_row = 0
-        for i in range(len(self.tile_list)):
-            self.tile_button = button.Button(self.GAME_WIDTH + (75 * self.button_col) + 50, 75 * self.button_row + 50, self.tile_list[i], 1)
-            self.button_list.append(self.tile_button)
-            self.button_col += 1
-            if self.button_col == 3:
-                self.button_row += 1
-                self.button_col = 0
+        # Scrollable tile palette in the side margin
+        self.palette = palette.Palette(self.tile_list, (self.GAME_WIDTH, 0, self.SIDE_MARGIN, self.GAME_HEIGHT + self.LOWER_MARGIN))
 
 
         # Create player
@@ -97,233 +150,721 @@ class Game:
         self.all_sprites = pygame.sprite.Group()  # Create a sprite group
         self.all_sprites.add(self.player) 
 
-        # load menu and intro
-        self.menu = scenes.LevelMenu(self.screen)
+        # Time the players movement and collision separately when profiling
+        self.profiler.instrument(self.player, "horizontal_movement", "player.movement")
+        self.profiler.instrument(self.player, "vertical_movement", "player.movement")
+        self.profiler.instrument(self.player, "move_and_collide", "player.collision")
+        self.profiler.instrument(self, "draw_background", "draw_background")
+        self.profiler.instrument(self, "draw_world", "draw_world")
+
+        # Completed levels, best times and deaths
+        self.progress = ProgressStore()
+
+        # load menu, intro and end screens once, they are reused every time they are shown
+        self.menu = scenes.LevelMenu(self.screen, self.progress, self.levels.prefetch)
         self.intro = scenes.Intro(self.screen)
+        self.death_screen = scenes.Standard(self.screen, "You died", (255, 0, 0))
+        self.won_screen = scenes.Standard(self.screen, "Level completed!", (0, 255, 0))
 
 
-    def draw_background(self):
-        self.screen.fill(self.GREEN)
+    def draw_background(self, surface=None):
+        if surface is None:
+            surface = self.screen
+        surface.fill(self.GREEN)
         width = self.factory_background.get_width()
         for x in range(0, self.GAME_WIDTH, width):
-            self.screen.blit(self.factory_background, (x * 0.5, 0))
+            surface.blit(self.factory_background, (x * 0.5, 0))
 
 
-    def draw_grid(self):
+    def draw_grid(self, surface=None):
+        if surface is None:
+            surface = self.screen
         # vertical lines
         for c in range(self.COLS + 1):
-            pygame.draw.line(self.screen, self.WHITE, (c * self.TILE_SIZE, 0), (c * self.TILE_SIZE, self.GAME_HEIGHT))
+            pygame.draw.line(surface, self.WHITE, (c * self.TILE_SIZE, 0), (c * self.TILE_SIZE, self.GAME_HEIGHT))
             
         # horizontal lines
         for c in range(self.ROWS + 1):
-            pygame.draw.line(self.screen, self.WHITE, (0, c * self.TILE_SIZE), (self.GAME_WIDTH, c * self.TILE_SIZE))
+            pygame.draw.line(surface, self.WHITE, (0, c * self.TILE_SIZE), (self.GAME_WIDTH, c * self.TILE_SIZE))
 
 
-    def draw_world(self):
+    def draw_world(self, surface=None):
         """render each tile from tilemap"""
+        if surface is None:
+            surface = self.screen
         for y, row in enumerate(self.world_data):
             for x, tile in enumerate(row):
                 if tile >= 0:
-                    self.screen.blit(self.tile_list[tile], (x * self.TILE_SIZE, y * self.TILE_SIZE))
+                    surface.blit(self.tile_list[tile], (x * self.TILE_SIZE, y * self.TILE_SIZE))
+
+
+    def build_static_layer(self):
+        """render background, grid (in editor) and tiles once to an offscreen surface"""
+        self.background_layer = pygame.Surface((self.GAME_WIDTH, self.GAME_HEIGHT)).convert()
+        self.draw_background(self.background_layer)
+        if self.show_grid:
+            self.draw_grid(self.background_layer)
+
+        self.static_layer = self.background_layer.copy()
+        if self.chunked_world is None:
+            self.draw_world(self.static_layer)
+
+
+    def update_static_cell(self, x, y):
+        """re-render a single tile of the static layer after it has been edited"""
+        cell = pygame.Rect(x * self.TILE_SIZE, y * self.TILE_SIZE, self.TILE_SIZE, self.TILE_SIZE)
+        self.static_layer.blit(self.background_layer, cell, cell)
+
+        tile = self.world_data.get(x, y)
+        if tile >= 0:
+            self.static_layer.blit(self.tile_list[tile], cell)
+
+        self.dirty_cells.append(cell)
+
+
+    def tiles_changed(self, x, y, width, height):
+        """keep the static layer up to date with a region of tiles that changed"""
+        if self.static_layer is None or width * height > self.STATIC_REBUILD_CELLS:
+            self.build_static_layer()
+            self.full_redraw = True
+            return
+
+        for row in range(y, y + height):
+            for column in range(x, x + width):
+                self.update_static_cell(column, row)
+
+
+    def draw_static_layer(self):
+        """draw the cached background and tiles with a single blit"""
+        self.screen.blit(self.static_layer, (0, 0))
+
+    
+    def draw_button(self, button):
+        """draw a button"""
+        self.screen.blit(button.image, button.rect)
+
+
+    def mark_dirty(self, rect):
+        """remember a region of the screen that changed this frame"""
+        self.dirty_rects.append(pygame.Rect(rect))
+
+
+    def update_display(self, full_redraw):
+        """update the whole window, or in dirty rect mode only the regions that changed"""
+        if full_redraw:
+            pygame.display.update()
+        elif self.dirty_rects:
+            pygame.display.update(self.dirty_rects)
+        self.dirty_rects = []
+
+
+    def draw_profiler_overlay(self, full_redraw, restore=True):
+        """draw the profiler overlay, with restore the static layer is put back where the last one was"""
+        if restore and self.overlay_rect and not full_redraw:
+            self.screen.blit(self.static_layer, self.overlay_rect, self.overlay_rect)
+            self.mark_dirty(self.overlay_rect)
+
+        self.overlay_rect = self.profiler.draw_overlay(self.screen)
+        if self.overlay_rect:
+            self.mark_dirty(self.overlay_rect)
 
     
     def draw_text(self, text, font, text_col, x, y):
         """function to easily draw text"""
-        img = self.font.render(text, True, text_col)
+        img = text_cache.render(font, text, text_col)
         self.screen.blit(img, (x, y))
 
     def load_level(self):
         """open level file and add to world_data"""
         print("loading level")
+        if self.chunked_world is not None:
+            self.chunked_world.close()
+            self.chunked_world = None
+
+        path = level_format.level_path(self.level)
+        if self.allow_chunked and path.endswith(level_format.CHUNKED_EXTENSION):
+            self.load_chunked_level(path)
+            return
+
+        self.level_file_tiles = TileMap(self.COLS, self.ROWS)
         try:
-            with open(f'./levels/level{self.level}_data.csv', newline='') as csvfile:
-                reader = csv.reader(csvfile, delimiter = ',')
-                for x, row in enumerate(reader):
-                    for y, tile in enumerate(row):
-                        self.world_data[x][y] = int(tile)
+            world_data, self.tileset = self.levels.get(self.level)
+            self.level_file_tiles.paste(world_data)
 
         except FileNotFoundError:
             print("file not found")
-            self.world_data = [[-1 for _ in row] for row in self.world_data]
+
+        # Replacing the tiles renders the static layer again and, once the player has
+        # hitboxes for world_data, rebuilds them through the change hooks
+        self.world_data.replace(self.level_file_tiles)
+
+        self.entities = self.load_entities()
+
+        # Precompute tile hitboxes for the players collision checks
+        self.player.world_width = self.GAME_WIDTH
+        self.player.world_height = self.GAME_HEIGHT
+        if self.player.hitbox_world is not self.world_data:
+            self.player.build_tile_hitboxes(self.world_data, self.TILE_SIZE)
+
+    def load_entities(self):
+        """entities of the current level, a broken entity file is reported and the level played without them"""
+        try:
+            return entities.load(self.level, self.TILE_SIZE, self.tile_list)
+        except (OSError, entities.EntityError) as error:
+            print(f"could not load entities: {error}")
+            return None
+
+    def load_chunked_level(self, path):
+        """open a chunked level, its chunks are streamed in around the camera while playing"""
+        self.chunked_world = ChunkedWorld(path, self.tile_list, self.TILE_SIZE)
+        self.tileset = self.chunked_world.tileset
+        self.entities = self.load_entities()
+        self.player.build_tile_hitboxes(self.chunked_world, self.TILE_SIZE)
+        self.camera.rect.topleft = (0, 0)
+        self.build_static_layer()
+        self.full_redraw = True
+
+    def level_written(self):
+        """the level file now holds world_data"""
+        self.levels.invalidate(self.level)
+        self.level_file_tiles = self.world_data.copy()
+
+    def reload_changed_level(self):
+        """apply changes made to the level file outside the game, only tiles that differ are set
+
+        Tiles are diffed against what the file held before, so edits made in this editor that
+        arent saved yet are kept. The player and entities carry on where they are"""
+        if self.level not in self.level_watcher.poll() or self.chunked_world is not None:
+            return
+        try:
+            world_data, tileset = self.levels.get(self.level)
+        except (OSError, ValueError, level_format.LevelFormatError) as error:
+            # Most likely caught halfway through being written, the next change is picked up
+            print(f"could not reload level {self.level}: {error}")
+            return
+
+        file_tiles = TileMap(self.COLS, self.ROWS)
+        file_tiles.paste(world_data)
+        changes = self.level_file_tiles.changes(file_tiles)
+        for x, y, tile in changes:
+            self.world_data.set(x, y, tile)
+        self.level_file_tiles = file_tiles
+        if changes:
+            print(f"reloaded level {self.level}, {len(changes)} tiles changed")
+
+    def open_journal(self):
+        """journal edits to the current level, recovering changes an earlier session didnt save"""
+        path = level_format.level_path(self.level)
+        if path.endswith(level_format.CHUNKED_EXTENSION):
+            # Chunked levels are only previewed, edits to them can be undone but arent saved
+            path = None
+
+        try:
+            recovered = self.journal.open(path, self.world_data)
+        except (OSError, journal.JournalError) as error:
+            # A broken log is kept for a look by hand, the level opens as it was saved
+            broken_path = self.journal.move_aside()
+            print(f"could not recover unsaved changes to level {self.level}: {error}, the log was moved to {broken_path}")
+            recovered = self.journal.open(path, self.world_data)
+        if recovered:
+            print(f"recovered {recovered} unsaved changes to level {self.level}")
+
+    def edit_tile(self, x, y, tile):
+        """change one tile of the level through the journal"""
+        old = self.world_data.set(x, y, tile)
+        if old != tile:
+            self.journal.record(x, y, old, tile)
+
+    def undo(self, redo=False):
+        """undo or redo the last stroke in the editor, the static layer follows through tiles_changed"""
+        if redo:
+            self.journal.redo(self.world_data)
+        else:
+            self.journal.undo(self.world_data)
+
+    def compact_journal(self, force=False):
+        """write every journaled edit into the level file, with force the file is written even without edits"""
+        if force and self.journal.level_path is None:
+            print("chunked levels can only be previewed in the editor, edit the level it was converted from")
+            return
+        self.journal.flush()
+        if self.journal.compact(self.world_data, self.tileset, force):
+            self.level_written()
+
+    def check_level(self):
+        """start checking in the background that the goals of the saved level can be reached"""
+        path = level_format.level_path(self.level)
+        if not os.path.exists(path):
+            return
+        if self.analyzer is None:
+            self.analyzer = ProcessPoolExecutor(max_workers=1)
+        self.analysis = self.analyzer.submit(reachability.analyze_level, path, self.level)
+
+    def report_level_check(self):
+        """print the result of the level check once it is done"""
+        if self.analysis is not None and self.analysis.done():
+            # A check that fails is reported, it must never stop the editor
+            try:
+                print("\n".join(reachability.format_report(self.analysis.result())))
+            except Exception as error:
+                print(f"could not check level {self.level}: {error}")
+            self.analysis = None
+
+    def stop_level_check(self):
+        """stop the worker checking levels without waiting for a check it is running"""
+        if self.analyzer is None:
+            return
+        # The executor has no way to stop a running call, so its worker process is killed,
+        # terminate isnt enough as the worker inherits the SIGTERM handler SDL installs
+        processes = list(self.analyzer._processes.values())
+        self.analyzer.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+        self.analyzer = None
+        self.analysis = None
+
+    def autosave(self):
+        """append new edits to the journal log, compacting it into the level file when it gets long"""
+        self.last_autosave = pygame.time.get_ticks()
+        if self.journal.autosave(self.world_data, self.tileset):
+            self.level_written()
 
     def reset(self):
         """reset player to start with atrributes"""
-        self.player.pos = self.player.vec(0, 0)
-        self.player.vel = self.player.vec(0, 0)
-        self.player.acc = self.player.vec(0, 0)
-        self.player.rect.topleft = (0, 0)
-        self.player.grounded = False
-        self.player.is_jumping = False
-        self.player.has_won = False
-        self.player.dead = False
-        self.player.dead_screen = False
-        self.player.is_playing_jump_animation = False
-
-    def update_completed_levels(self, input_list):
-        """write completed levels to file"""
-        with open("./completed_levels.py", 'w') as f:
-            # Write the list to the file
-            f.write(f'completed_levels = {input_list}\n')
+        self.player.reset(0, 0)
+        if self.entities is not None:
+            self.entities.reset()
 
 
     def run_editor(self):
         """game editor"""
+        self.show_grid = True
         self.load_level()
+        self.open_journal()
         while True:
-            self.draw_background()
-            self.draw_grid()
-            self.draw_world()
-
-            # Margins for buttons
-            pygame.draw.rect(self.screen, self.GREY, (self.GAME_WIDTH, 0, self.SIDE_MARGIN, self.GAME_WIDTH))
-            pygame.draw.rect(self.screen, self.GREY, (0, self.GAME_HEIGHT, self.GAME_WIDTH, self.GAME_HEIGHT + self.LOWER_MARGIN))
-
-            # Text
-            self.draw_text(f'Level: {self.level}', self.font, self.WHITE, 10, self.GAME_HEIGHT + self.LOWER_MARGIN - 90)
-            self.draw_text('Press UP or DOWN to change level', self.font, self.WHITE, 10, self.GAME_HEIGHT + self.LOWER_MARGIN - 60)
-
-            # Save button
-            if self.save_button.draw(self.screen):
-                with open(f'./levels/level{self.level}_data.csv', 'w', newline='') as csvfile:
-                    writer = csv.writer(csvfile, delimiter = ',')
-                    for row in self.world_data:
-                        writer.writerow(row)
-
-            # Load button
-            if self.load_button.draw(self.screen):
-                self.load_level()
-
-            # Tile buttons
-            self.button_count = 0
-            for self.button_count, i in enumerate(self.button_list):
-                if i.draw(self.screen):
-                    self.current_tile = self.button_count
-
-            # Highlight the selected tile
-            pygame.draw.rect(self.screen, self.RED, self.button_list[self.current_tile].rect, 3)
+            self.profiler.start_frame()
 
-            # Place tile on map
-            pos = pygame.mouse.get_pos()
-            x = (pos[0]) // self.TILE_SIZE
-            y = pos[1] // self.TILE_SIZE
- 
-            if pos[0] < self.GAME_WIDTH and pos[1] < self.GAME_HEIGHT:
-                #update tile value
-                if pygame.mouse.get_pressed()[0] == 1:
-                    if self.world_data[y][x] != self.current_tile:
-                        self.world_data[y][x] = self.current_tile
-                if pygame.mouse.get_pressed()[2] == 1:
-                    self.world_data[y][x] = -1
-
-            # Event loop
-            for event in pygame.event.get():
+            # Input for this frame, the mouse is read once and clicks come from events
+            events = pygame.event.get()
+            mouse_pos = pygame.mouse.get_pos()
+            mouse_buttons = pygame.mouse.get_pressed()
+            palette_changed = False
+
+            for event in events:
                 if event.type == pygame.QUIT:
+                    self.compact_journal()
+                    # Close the window first, a check that is still running must not keep it open
                     pygame.quit()
+                    self.stop_level_check()
                     sys.exit()
-                
+
+                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    # Save button writes the edits into the level file
+                    if self.save_button.rect.collidepoint(event.pos):
+                        self.compact_journal(force=True)
+                        self.check_level()
+
+                    # Load button throws away unsaved edits and reloads the level file
+                    elif self.load_button.rect.collidepoint(event.pos):
+                        self.journal.discard()
+                        self.load_level()
+                        self.open_journal()
+
+                    # Tile palette
+                    else:
+                        tile = self.palette.hit(event.pos)
+                        if tile is not None and tile != self.current_tile:
+                            self.current_tile = tile
+                            palette_changed = True
+
+                if event.type == pygame.MOUSEWHEEL and self.palette.rect.collidepoint(mouse_pos):
+                    palette_changed = self.palette.scroll(-event.y) or palette_changed
+
+                # A click or drag is one stroke to undo
+                if event.type == pygame.MOUSEBUTTONUP:
+                    self.journal.end_stroke()
+
                 if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_z and event.mod & pygame.KMOD_CTRL:
+                        self.undo(redo=bool(event.mod & pygame.KMOD_SHIFT))
+                    if event.key == pygame.K_y and event.mod & pygame.KMOD_CTRL:
+                        self.undo(redo=True)
                     if event.key == pygame.K_UP:
+                        self.compact_journal()
                         self.level += 1
                         self.load_level()
+                        self.open_journal()
                     if event.key == pygame.K_DOWN and self.level > 0:
+                        self.compact_journal()
                         self.level -= 1
                         self.load_level()
+                        self.open_journal()
+            self.profiler.lap("events")
+
+            full_redraw = self.full_redraw or not self.dirty_rect_mode
+            self.full_redraw = False
+
+            if full_redraw:
+                self.draw_static_layer()
+
+                # Margins for buttons
+                pygame.draw.rect(self.screen, self.GREY, (self.GAME_WIDTH, 0, self.SIDE_MARGIN, self.GAME_WIDTH))
+                pygame.draw.rect(self.screen, self.GREY, (0, self.GAME_HEIGHT, self.GAME_WIDTH, self.GAME_HEIGHT + self.LOWER_MARGIN))
+
+                # Text
+                self.draw_text(f'Level: {self.level}', self.font, self.WHITE, 10, self.GAME_HEIGHT + self.LOWER_MARGIN - 90)
+                self.draw_text('Press UP or DOWN to change level', self.font, self.WHITE, 10, self.GAME_HEIGHT + self.LOWER_MARGIN - 60)
+            else:
+                # Only redraw the tiles edited since last frame
+                for cell in self.dirty_cells:
+                    self.screen.blit(self.static_layer, cell, cell)
+                    self.mark_dirty(cell)
+            self.dirty_cells = []
+            self.profiler.lap("static layer")
+
+            # Draw buttons, in dirty rect mode the palette only when the selection or scroll changed
+            if full_redraw:
+                self.draw_button(self.save_button)
+                self.draw_button(self.load_button)
+            if full_redraw or palette_changed:
+                self.mark_dirty(self.palette.draw(self.screen, self.current_tile))
+            self.profiler.lap("buttons")
 
-            pygame.display.update()
+            # Place tile on map
+            x = mouse_pos[0] // self.TILE_SIZE
+            y = mouse_pos[1] // self.TILE_SIZE
+
+            if mouse_pos[0] < self.GAME_WIDTH and mouse_pos[1] < self.GAME_HEIGHT:
+                #update tile value
+                if mouse_buttons[0] == 1:
+                    self.edit_tile(x, y, self.current_tile)
+                if mouse_buttons[2] == 1:
+                    self.edit_tile(x, y, -1)
+            self.profiler.lap("paint")
+
+            # Autosave edits as small deltas
+            if pygame.time.get_ticks() - self.last_autosave >= journal.AUTOSAVE_INTERVAL:
+                self.autosave()
+            self.report_level_check()
+            self.reload_changed_level()
+
+            self.draw_profiler_overlay(full_redraw)
+            self.profiler.lap("overlay")
+
+            self.update_display(full_redraw)
+            self.profiler.lap("display.update")
+            self.profiler.end_frame()
             self.clock.tick(self.FPS)
 
-    def run_game(self, hitbox):
-        """gameplay"""
-        self.screen = pygame.display.set_mode((self.GAME_WIDTH, self.GAME_HEIGHT))
+    def finish_replay(self, frames, start_time):
+        """report the result of a replay and quit"""
+        elapsed = time.perf_counter() - start_time
+        print(f"replayed level {self.level}: {replay.outcome(self.player.has_won, self.player.dead)} "
+              f"after {frames} frames, {frames / elapsed:.1f} frames/sec")
+        pygame.quit()
+        sys.exit()
+
+    def complete_level(self, frames):
+        """mark the current level as completed and move the menu to the next one"""
+        if self.progress.record_win(self.level, frames):
+            print(f"new best time on level {self.level}: {frames} frames")
+        self.menu.selected_index += 1
+
+    def step_player(self, inputs):
+        """advance the player one simulation step, returns the next scene when the level ends"""
+        world = self.chunked_world if self.chunked_world is not None else self.world_data
+        if self.entities is not None:
+            self.entities.update(self.player)
+        self.player.update_inputs(inputs, world, self.TILE_SIZE)
+        if self.entities is not None:
+            self.entities.collide(self.player)
+
+        # Handle win or death conditions
+        if self.player.has_won:
+            print("LEVEL COMPLETED")
+            return "won"
+        if self.player.dead_screen:
+            return "death"
+        return None
+
+    def draw_frame(self, full_redraw, hitbox, alpha=1):
+        """draw gameplay, alpha places the player between its last two simulation steps"""
+        # Render cached game world, in dirty rect mode only where the player was
+        offset = (0, 0)
+        if self.chunked_world is not None:
+            # The camera scrolls, so the whole screen changes
+            self.full_redraw = True
+            self.camera.follow(self.player.interpolated_rect(alpha), self.chunked_world.width, self.chunked_world.height)
+            self.chunked_world.stream(self.camera.rect)
+            self.draw_static_layer()
+            self.chunked_world.draw(self.screen, self.camera)
+            offset = self.camera.offset()
+        elif full_redraw:
+            self.draw_static_layer()
+        elif self.player_dirty_rect:
+            self.screen.blit(self.static_layer, self.player_dirty_rect, self.player_dirty_rect)
+            self.mark_dirty(self.player_dirty_rect)
+
+        # Tiles changed since the last frame, by a level file reloaded while playing
+        if not full_redraw and self.chunked_world is None and self.dirty_cells:
+            self.screen.blits([(self.static_layer, cell, cell) for cell in self.dirty_cells], doreturn=False)
+            self.dirty_rects.extend(self.dirty_cells)
+        self.dirty_cells = []
+        self.profiler.lap("static layer")
+
+        # Render entities, in dirty rect mode the static layer is put back where they were first
+        if self.entities is not None:
+            if not full_redraw and self.chunked_world is None:
+                self.screen.blits([(self.static_layer, rect, rect) for rect in self.entity_rects], doreturn=False)
+                self.dirty_rects.extend(self.entity_rects)
+            self.entity_rects = self.entities.draw(self.screen, offset, alpha)
+            self.dirty_rects.extend(self.entity_rects)
+            self.profiler.lap("entities.draw")
+
+        # Render player
+        self.player.draw(self.screen, offset, alpha)
+
+        if hitbox:
+            self.player.draw_hitbox(self.screen, offset, alpha)
+        self.profiler.lap("player.draw")
+
+        self.player_dirty_rect = self.player.sprite_rect(alpha=alpha).union(self.player.interpolated_rect(alpha))
+        self.mark_dirty(self.player_dirty_rect)
+
+    def set_game_mode(self):
+        """open the game window, synced to the display refresh when vsync is on"""
+        size = (self.GAME_WIDTH, self.GAME_HEIGHT)
+        if self.vsync:
+            try:
+                return pygame.display.set_mode(size, pygame.SCALED, vsync=1)
+            except pygame.error:
+                print("vsync is not available, drawing without it")
+        return pygame.display.set_mode(size)
+
+    def run_game(self, hitbox, replay_run=None, recorder=None):
+        """gameplay, replay_run is a (level, inputs) run log to play back instead of the keyboard"""
+        self.screen = self.set_game_mode()
+        self.allow_chunked = True
+
+        # Replays go straight to their level
+        if replay_run is not None:
+            self.level = replay_run[0]
+            self.scene = "game"
+
         self.load_level()
 
+        # Whatever way the game exits, batched progress is saved
+        atexit.register(self.progress.flush)
+
+        self.scenes = scenes.SceneManager({
+            "intro": self.intro,
+            "select": self.menu,
+            "game": GameScene(self, hitbox, replay_run, recorder),
+            "death": self.death_screen,
+            "won": self.won_screen,
+        }, self.scene)
+
         while True:
-            # Process events
-            for event in pygame.event.get():
+            self.profiler.start_frame()
+
+            # Process events, idle scenes block here until there is input
+            for event in self.scenes.events():
                 if event.type == pygame.QUIT:
+                    if recorder:
+                        recorder.save()
+                    self.progress.flush()
                     pygame.quit()
                     sys.exit()
-                
-                # Handle scene-specific events
-                if self.scene == "select":
-                    selected_level = self.menu.handle_event(event)
-                    if selected_level is not None:
-                        print("SELECTED LEVEL: ", selected_level)
-                        self.level = selected_level
-                        self.load_level()
-                        self.scene = "game"
-
-                elif self.scene == "intro":
-                    if self.intro.handle_event(event):
-                        self.scene = "select"
-
-            # Update logic based on the current scene
-            if self.scene == "select":
-                self.menu.render()
-
-            elif self.scene == "intro":
-                self.intro.render_slide()
-
-            elif self.scene == "game":
-                keys = pygame.key.get_pressed()
-
-                # Update and render game world
-                self.draw_background()
-                self.draw_world()
-
-                # Update and render player
-                self.player.update(keys, self.world_data, self.TILE_SIZE)
-                self.player.draw(self.screen)
-
-                if hitbox:
-                    self.player.draw_hitbox(self.screen)
-
-                # Handle win or death conditions
-                if self.player.has_won:
-                    print("LEVEL COMPLETED")
-                    self.scene = "won"
-                    
-
-                elif self.player.dead_screen:
-                    self.scene = "death"
-
-            elif self.scene == "death":
-                # Render the death screen
-                if scenes.Standard(self.screen).text_and_continue("You died", (255, 0, 0)):
-                    self.scene = "select"  # Reset to level selection or another appropriate scene
-                    self.reset()
 
-            elif self.scene == "won":
-                # Render the win screen
-                if scenes.Standard(self.screen).text_and_continue("Level completed!", (0, 255, 0)):
-
-                    if self.level not in completed_levels:
-                        completed_levels.append(self.level)
-
-                    self.update_completed_levels(completed_levels)
-                    self.scene = "select"
-                    self.menu.selected_index += 1
-                    self.reset()
-
-            # Update the display and maintain FPS
-            pygame.display.update()
-            self.clock.tick(self.FPS)
-
-# Command line arguments
-parser = argparse.ArgumentParser()
-parser.add_argument("--editor", "-e", action="store_true") # level editor
-parser.add_argument("--hitbox", action="store_true") # show hitbox ingame
-parser.add_argument("--skip-intro", "-i", action="store_true") # skip intro
-
-args = parser.parse_args()
-
-# Run game based on arguments
-if args.editor:
-    Game("intro").run_editor()
-else:
-    if args.skip_intro:
-        scene = "select"
+                self.scenes.handle_event(event)
+            self.profiler.lap("events")
+
+            full_redraw = self.full_redraw or not self.dirty_rect_mode
+            self.full_redraw = False
+
+            # Idle scenes draw themselves only when they changed
+            if self.scenes.render(full_redraw):
+                self.mark_dirty(self.screen.get_rect())
+            self.profiler.lap("scene render")
+
+            # Gameplay runs the simulation steps that are due and draws every frame
+            self.scenes.update(full_redraw)
+            full_redraw = full_redraw or self.full_redraw
+
+            self.draw_profiler_overlay(full_redraw, restore=not self.scenes.current.idle)
+            self.profiler.lap("overlay")
+
+            # Update the display
+            self.update_display(full_redraw)
+            self.profiler.lap("display.update")
+
+            # Progress is saved in batches, not on every win or death
+            self.progress.flush_if_due()
+            self.profiler.end_frame()
+
+            # Pace frames and bank the time for the next simulation steps
+            self.timestep.add(self.pacer.tick())
+
+
+class GameScene(scenes.Scene):
+    """gameplay scene, plays the selected level or a replay from the keyboard or a run log"""
+    idle = False
+
+    def __init__(self, game, hitbox, replay_run=None, recorder=None):
+        super().__init__(game.screen)
+        self.game = game
+        self.hitbox = hitbox
+        self.replay_run = replay_run
+        self.recorder = recorder
+        self.replay_inputs = None
+        self.replay_start = 0
+
+        # Frames played of the current attempt, the time kept as a best time on a win
+        self.frames = 0
+
+    def enter(self):
+        """load the level and start the player, replays start on their own level"""
+        game = self.game
+        self.frames = 0
+        if self.replay_run is not None:
+            self.replay_inputs = iter(self.replay_run[1])
+            self.replay_start = time.perf_counter()
+        else:
+            print("SELECTED LEVEL: ", game.menu.selected_index)
+            game.level = game.menu.selected_index
+            game.load_level()
+            if self.recorder:
+                self.recorder.start(game.level)
+        game.reset()
+        game.full_redraw = True
+
+        # Time spent in menus and loading isnt simulated
+        game.timestep.reset()
+        game.pacer.restart()
+
+    def exit(self):
+        """save the run and get the next level ready while the end screen is up"""
+        game = self.game
+        if self.replay_run is not None:
+            game.finish_replay(self.frames, self.replay_start)
+        if self.recorder:
+            self.recorder.save()
+        if game.player.has_won:
+            game.complete_level(self.frames)
+        elif game.player.dead:
+            game.progress.record_death(game.level)
+        game.levels.prefetch(game.level + 1)
+        game.reset()
+
+    def next_inputs(self):
+        """input for the next simulation step, from the run log or the keyboard"""
+        if self.replay_run is not None:
+            inputs = next(self.replay_inputs, None)
+            if inputs is None:
+                self.game.finish_replay(self.frames, self.replay_start)
+        else:
+            inputs = inputs_from_keys(pygame.key.get_pressed())
+            if self.recorder:
+                self.recorder.record(inputs)
+        return inputs
+
+    def update(self, full_redraw):
+        """run the simulation steps due since the last frame, then draw"""
+        game = self.game
+        if self.replay_run is None:
+            game.reload_changed_level()
+        for _ in range(game.timestep.steps()):
+            self.frames += 1
+            next_scene = game.step_player(self.next_inputs())
+            if next_scene:
+                return next_scene
+        game.profiler.lap("player.update")
+
+        game.draw_frame(full_redraw, self.hitbox, game.timestep.alpha())
+        return None
+
+
+if __name__ == "__main__":
+    # Command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--editor", "-e", action="store_true") # level editor
+    parser.add_argument("--hitbox", action="store_true") # show hitbox ingame
+    parser.add_argument("--skip-intro", "-i", action="store_true") # skip intro
+    parser.add_argument("--dirty-rects", action="store_true") # only update changed parts of the screen
+    parser.add_argument("--profile", nargs="?", const="profile_trace.json") # time frame phases, write trace here on exit
+    parser.add_argument("--record") # save the input of every attempt to this run log
+    parser.add_argument("--replay") # play back a run log
+    parser.add_argument("--headless", action="store_true") # replay without a display as fast as possible
+    parser.add_argument("--batch", nargs="+") # replay run logs or directories of them headless across worker processes
+    parser.add_argument("--jobs", "-j", type=int) # worker processes for --batch, one per CPU by default
+    parser.add_argument("--reset-progress", action="store_true") # forget completed levels, best times and deaths
+    parser.add_argument("--fps", type=int) # cap on frames drawn per second, 0 for uncapped, the game itself always runs at 60
+    parser.add_argument("--vsync", action="store_true") # draw in step with the display refresh, uncapped unless --fps is given
+    parser.add_argument("--busy-loop", action="store_true") # hold the frame cap precisely by spinning instead of sleeping
+
+    args = parser.parse_args()
+
+    # A run log that cant be replayed, like one recorded with older physics, is reported before anything opens
+    replay_run = None
+    if args.replay:
+        try:
+            replay_run = replay.load_run(args.replay)
+        except (OSError, replay.RunLogError) as error:
+            print(error)
+            sys.exit(1)
+
+    # Headless replays only need the physics
+    if args.replay and args.headless:
+        result = replay.replay_headless(args.replay)
+        print(f"replayed level {result['level']}: {result['outcome']} after {result['frames']} frames, "
+              f"{result['fps']:.0f} frames/sec")
+        sys.exit()
+
+    # Batches of runs are spread over worker processes, each keeping the levels it has parsed
+    if args.batch:
+        results, elapsed = replay.replay_batch(args.batch, args.jobs)
+        failed = 0
+        total_frames = 0
+        for result in results:
+            if "error" in result:
+                failed += 1
+                print(result["error"])
+                continue
+            total_frames += result["frames"]
+            print(f"{result['path']}: level {result['level']} {result['outcome']} after {result['frames']} frames, "
+                  f"{result['fps']:.0f} frames/sec")
+        print(f"{len(results)} runs, {total_frames} frames in {elapsed:.2f} s, "
+              f"{total_frames / elapsed:.0f} simulated frames/sec")
+        sys.exit(1 if failed else 0)
+
+    if args.reset_progress:
+        progress = ProgressStore()
+        progress.reset()
+        progress.flush()
+        print(f"reset progress in {progress.path}")
+        sys.exit()
+
+    # Profile frames and export the trace when the game exits
+    profiler = None
+    if args.profile:
+        profiler = FrameProfiler()
+        atexit.register(profiler.export_trace, args.profile)
+
+    # Frames are capped at the simulation rate unless asked otherwise
+    fps = args.fps
+    if fps is None:
+        fps = 0 if args.vsync else FPS
+    pacer = FramePacer(fps, args.busy_loop)
+
+    # Run game based on arguments
+    if args.editor:
+        Game("intro", args.dirty_rects, profiler).run_editor()
     else:
-        scene = "intro"
+        if args.skip_intro:
+            scene = "select"
+        else:
+            scene = "intro"
         
-    Game(scene).run_game(args.hitbox)
\ No newline at end of file
+        recorder = replay.RunRecorder(args.record) if args.record else None
+
+        Game(scene, args.dirty_rects, profiler, pacer, args.vsync).run_game(args.hitbox, replay_run, recorder)
\ No newline at end of file
@@ -0,0 +1,73 @@
+import pygame
+
+class Palette:
+    """Scrollable grid of tile images for the editor, only the rows in view are drawn
+
+    Clicks are hit-tested with grid arithmetic, so the cost doesnt grow with the number of tiles"""
+    def __init__(self, images, rect, columns=3, spacing=75, margin=50):
+        self.images = images
+        self.rect = pygame.Rect(rect)
+        self.columns = columns
+        self.spacing = spacing
+        self.margin = margin
+        self.scroll_row = 0
+
+        self.background_color = (189, 189, 189)
+        self.selected_color = (200, 25, 25)
+
+    def rows(self):
+        """rows needed for every image"""
+        return (len(self.images) + self.columns - 1) // self.columns
+
+    def visible_rows(self):
+        """rows that fit in the palette area"""
+        return max((self.rect.height - self.margin) // self.spacing, 1)
+
+    def scroll(self, rows):
+        """scroll by a number of rows, returns True if the view moved"""
+        last_row = max(self.rows() - self.visible_rows(), 0)
+        scroll_row = max(0, min(self.scroll_row + rows, last_row))
+        moved = scroll_row != self.scroll_row
+        self.scroll_row = scroll_row
+        return moved
+
+    def image_rect(self, index):
+        """where an image is drawn on screen"""
+        row, column = divmod(index, self.columns)
+        return self.images[index].get_rect(topleft=(
+            self.rect.x + self.margin + column * self.spacing,
+            self.rect.y + self.margin + (row - self.scroll_row) * self.spacing,
+        ))
+
+    def hit(self, pos):
+        """index of the image under a screen position, None if there is none"""
+        if not self.rect.collidepoint(pos):
+            return None
+
+        x = pos[0] - self.rect.x - self.margin
+        y = pos[1] - self.rect.y - self.margin
+        if x < 0 or y < 0:
+            return None
+        column, row = x // self.spacing, y // self.spacing
+        if column >= self.columns or row >= self.visible_rows():
+            return None
+
+        index = (row + self.scroll_row) * self.columns + column
+        if index >= len(self.images) or not self.image_rect(index).collidepoint(pos):
+            return None
+        return index
+
+    def draw(self, surface, selected=None):
+        """draw the rows in view and highlight the selected image"""
+        surface.fill(self.background_color, self.rect)
+
+        first = self.scroll_row * self.columns
+        last = min(first + self.visible_rows() * self.columns, len(self.images))
+        for index in range(first, last):
+            rect = self.image_rect(index)
+            surface.blit(self.images[index], rect)
+
+            # Highlight the selected tile
+            if index == selected:
+                pygame.draw.rect(surface, self.selected_color, rect, 3)
+        return self.rect
@@ -0,0 +1,132 @@
+import json
+import time
+from collections import deque
+import pygame
+
+class FrameProfiler:
+    """Times the phases of every frame, shows rolling averages in an overlay and exports a Chrome trace"""
+    def __init__(self, window=120, max_events=500000):
+        self.window = window
+        self.max_events = max_events
+
+        # Rolling history of (frame time, {phase: ms}) for the overlay
+        self.frames = deque(maxlen=window)
+
+        # Trace events as (phase, start, end) in perf_counter seconds
+        self.events = []
+        self.origin = time.perf_counter()
+
+        self.current = {}
+        self.frame_start = self.lap_start = self.origin
+
+        self.font = None
+        self.overlay_color = (255, 255, 255)
+        self.overlay_background = (0, 0, 0)
+
+    def start_frame(self):
+        """start timing a new frame"""
+        self.current = {}
+        self.frame_start = self.lap_start = time.perf_counter()
+
+    def record(self, phase, start, end):
+        """add time spent in a phase to the current frame"""
+        self.current[phase] = self.current.get(phase, 0) + (end - start) * 1000
+        if len(self.events) < self.max_events:
+            self.events.append((phase, start, end))
+
+    def lap(self, phase):
+        """record the time since the last lap as a phase"""
+        now = time.perf_counter()
+        self.record(phase, self.lap_start, now)
+        self.lap_start = now
+
+    def end_frame(self):
+        """finish the current frame and add it to the rolling history"""
+        now = time.perf_counter()
+        if len(self.events) < self.max_events:
+            self.events.append(("frame", self.frame_start, now))
+        self.frames.append(((now - self.frame_start) * 1000, self.current))
+
+    def instrument(self, obj, name, phase):
+        """time every call to a method of an object as a phase"""
+        method = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(phase, start, time.perf_counter())
+
+        setattr(obj, name, timed)
+
+    def summary(self):
+        """rolling average per phase, average frame time and the worst frame with its phases"""
+        if not self.frames:
+            return {}, 0, (0, {})
+
+        totals = {}
+        for _, phases in self.frames:
+            for phase, ms in phases.items():
+                totals[phase] = totals.get(phase, 0) + ms
+        averages = {phase: total / len(self.frames) for phase, total in totals.items()}
+        average_frame = sum(frame for frame, _ in self.frames) / len(self.frames)
+        worst = max(self.frames, key=lambda frame: frame[0])
+        return averages, average_frame, worst
+
+    def draw_overlay(self, screen, position=(5, 5)):
+        """draw rolling averages and the worst frame, returns the area drawn to"""
+        if self.font is None:
+            self.font = pygame.font.Font(None, 20)
+
+        averages, average_frame, (worst_frame, worst_phases) = self.summary()
+        lines = [f"frame {average_frame:6.2f} ms  worst {worst_frame:6.2f} ms"]
+        for phase in sorted(averages):
+            lines.append(f"{phase:18} {averages[phase]:6.2f}  worst {worst_phases.get(phase, 0):6.2f}")
+
+        images = [self.font.render(line, True, self.overlay_color) for line in lines]
+        width = max(image.get_width() for image in images) + 10
+        height = sum(image.get_height() for image in images) + 10
+
+        rect = pygame.Rect(position, (width, height))
+        pygame.draw.rect(screen, self.overlay_background, rect)
+        y = rect.y + 5
+        for image in images:
+            screen.blit(image, (rect.x + 5, y))
+            y += image.get_height()
+        return rect
+
+    def export_trace(self, path):
+        """write recorded phases as a Chrome trace (chrome://tracing or Perfetto)"""
+        trace_events = []
+        for phase, start, end in self.events:
+            trace_events.append({
+                "name": phase,
+                "cat": "frame",
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": 1,
+                "tid": 1,
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+        print(f"wrote profile trace to {path}")
+
+
+class NullProfiler:
+    """Stand-in used when profiling is off, does nothing"""
+    def start_frame(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def instrument(self, obj, name, phase):
+        pass
+
+    def draw_overlay(self, screen, position=(5, 5)):
+        return None
@@ -0,0 +1,152 @@
+import ast
+import json
+import os
+import sys
+import time
+from atomic import atomic_write
+from simulation import FPS
+
+VERSION = 1
+
+# Seconds between writes while playing, changes in between are batched
+FLUSH_INTERVAL = 5
+
+# Where completed levels were kept before the progress store
+LEGACY_PATH = "./completed_levels.py"
+
+
+def data_dir():
+    """per user directory for saved data"""
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share"))
+    return os.path.join(base, "kohlekraft")
+
+
+def default_path():
+    return os.path.join(data_dir(), "progress.json")
+
+
+def new_entry():
+    """progress of a level that hasnt been played"""
+    return {"completed": False, "best_frames": None, "deaths": 0}
+
+
+def read_legacy(path=LEGACY_PATH):
+    """completed levels from an old completed_levels.py, without importing it"""
+    try:
+        with open(path) as f:
+            source = f.read()
+        return [int(level) for level in ast.literal_eval(source.split("=", 1)[1].strip())]
+    except (OSError, IndexError, ValueError, SyntaxError, TypeError):
+        return []
+
+
+class ProgressStore:
+    """Completed levels, best times and deaths per level, kept in memory and saved as JSON
+
+    Writes are batched and go through a temporary file that replaces the old one, so a crash
+    never leaves a half written file"""
+    def __init__(self, path=None, flush_interval=FLUSH_INTERVAL):
+        self.path = path or default_path()
+        self.flush_interval = flush_interval
+        self.levels = {}
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        self.load()
+
+    def load(self):
+        """read progress from disk, a missing or broken file starts from scratch"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            # Entries may be edited by hand, keys left out get their defaults and anything else is dropped
+            self.levels = {}
+            for level, entry in data.get("levels", {}).items():
+                if isinstance(entry, dict) and str(level).lstrip("-").isdigit():
+                    self.levels[int(level)] = {**new_entry(), **entry}
+        except FileNotFoundError:
+            # First run with the progress store, bring over levels completed before it
+            self.levels = {}
+            for level in read_legacy():
+                self.level(level)["completed"] = True
+            self.dirty = bool(self.levels)
+        except (OSError, ValueError, AttributeError):
+            print(f"could not read progress from {self.path}, starting over")
+            self.levels = {}
+
+    def level(self, level):
+        """entry for a level, created when it is first needed"""
+        if level not in self.levels:
+            self.levels[level] = new_entry()
+        return self.levels[level]
+
+    def completed(self, level):
+        entry = self.levels.get(level)
+        return bool(entry and entry["completed"])
+
+    def unlocked(self, level):
+        """the first level is always unlocked, the others when the level before is completed"""
+        return level == 0 or self.completed(level - 1)
+
+    def completed_levels(self):
+        return sorted(level for level, entry in self.levels.items() if entry["completed"])
+
+    def best_frames(self, level):
+        entry = self.levels.get(level)
+        return entry["best_frames"] if entry else None
+
+    def best_time(self, level):
+        """best time in seconds of game time"""
+        frames = self.best_frames(level)
+        return frames / FPS if frames is not None else None
+
+    def deaths(self, level):
+        entry = self.levels.get(level)
+        return entry["deaths"] if entry else 0
+
+    def record_win(self, level, frames):
+        """mark a level completed, returns True if frames is a new best time"""
+        entry = self.level(level)
+        entry["completed"] = True
+        new_best = entry["best_frames"] is None or frames < entry["best_frames"]
+        if new_best:
+            entry["best_frames"] = frames
+        self.dirty = True
+        return new_best
+
+    def record_death(self, level):
+        self.level(level)["deaths"] += 1
+        self.dirty = True
+
+    def reset(self):
+        """forget all progress"""
+        self.levels = {}
+        self.dirty = True
+
+    def flush_if_due(self):
+        """save if something changed and the last save was long enough ago"""
+        if self.dirty and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """save now if something changed"""
+        if not self.dirty:
+            return False
+
+        data = {
+            "version": VERSION,
+            "levels": {str(level): entry for level, entry in sorted(self.levels.items())},
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        atomic_write(self.path, json.dumps(data, indent=4))
+
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        return True
@@ -0,0 +1,290 @@
+"""Checks that the goal tiles of every level can be reached with the players physics
+
+Searches from the spawn point over the places the player can land. From every landing spot
+a handful of walks and jump arcs are tried, run through BatchPhysics so every move from every
+new landing spot is stepped together with the real collision rules. A landing spot keeps the
+fewest frames it takes to get there, so the route found to a goal is the fastest one made of
+these moves. Levels are checked in parallel, one per worker process.
+
+    python reachability.py                 check every level in levels/
+    python reachability.py --routes runs   also save the fastest route to each goal as a run log
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import level_format
+import replay
+from batch import BatchPhysics, STATE_ARRAYS
+from simulation import INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP, FPS, frame_ticks
+
+# Moves tried from every landing spot as (direction, jump, frames the direction is held),
+# None holds the direction until the player lands
+MOVES = [
+    (INPUT_LEFT, False, 8), (INPUT_RIGHT, False, 8), (0, False, 8),
+    (INPUT_LEFT, True, None), (INPUT_RIGHT, True, None), (0, True, None),
+    (INPUT_LEFT, True, 8), (INPUT_RIGHT, True, 8),
+    (INPUT_LEFT, True, 16), (INPUT_RIGHT, True, 16),
+]
+
+# First move, the player drops from the spawn point before it can do anything
+SPAWN_MOVE = (0, False, 1)
+
+# A move that hasnt landed after this many frames is given up
+MAX_MOVE_FRAMES = 120
+
+# Routes longer than this are not searched
+MAX_ROUTE_FRAMES = 60 * FPS
+
+# Landing spots this many pixels apart on x or less count as the same spot
+X_BUCKET = 4
+
+RECT_X, RECT_Y, VEL_X, JUMP_ANIMATION = (
+    STATE_ARRAYS.index(name) for name in ("rect_x", "rect_y", "vel_x", "is_playing_jump_animation")
+)
+
+
+def goal_cells(batch):
+    """goal tiles of the level as (x, y, left, top, right, bottom)"""
+    cells = []
+    for y, x in zip(*np.nonzero(batch.tiles >= 0)):
+        if batch.goal[batch.tiles[y, x]]:
+            cells.append((int(x), int(y), *(int(edge) for edge in batch.tile_boxes[:, y, x])))
+    return cells
+
+
+def touched_goals(goals, x, y, width, height):
+    """goal cells overlapping a box"""
+    return [
+        (cell_x, cell_y) for cell_x, cell_y, left, top, right, bottom in goals
+        if x < right and x + width > left and y < bottom and y + height > top
+    ]
+
+
+def landing_key(state):
+    """landing spots that play out the same are merged"""
+    return (
+        state[RECT_X] // X_BUCKET, state[RECT_Y],
+        (state[VEL_X] > 0) - (state[VEL_X] < 0), state[JUMP_ANIMATION],
+    )
+
+
+def run_moves(batch, starts, moves, goals):
+    """try every move from every start, starts are (key, frames, state)
+
+    Returns the landings as (start, move, frames taken, state) and the goals touched
+    as (start, move, frames taken, goal cell)"""
+    start_index = np.repeat(np.arange(len(starts)), len(moves))
+    move_index = np.tile(np.arange(len(moves)), len(starts))
+    count = len(start_index)
+
+    states = list(zip(*(state for key, frames, state in starts)))
+    batch.load({name: np.array(states[column])[start_index] for column, name in enumerate(STATE_ARRAYS)})
+    start_frames = np.array([frames for key, frames, state in starts])[start_index]
+
+    direction = np.array([move[0] for move in moves])[move_index]
+    jump = np.array([move[1] for move in moves])[move_index]
+    hold = np.array([move[2] or MAX_MOVE_FRAMES for move in moves])[move_index]
+
+    active = np.ones(count, dtype=bool)
+    airborne = np.zeros(count, dtype=bool)
+    landings = []
+    hits = []
+    for frame in range(MAX_MOVE_FRAMES):
+        inputs = np.where(frame < hold, direction, 0) | np.where(jump & (frame == 0), INPUT_JUMP, 0)
+        before_x, before_y = batch.rect_x.copy(), batch.rect_y.copy()
+        batch.step(inputs, frame_ticks(start_frames + frame + 1))
+        taken = frame + 1
+
+        # The goal touched is somewhere between where the player was and is now
+        won = active & batch.has_won
+        for index in np.flatnonzero(won):
+            x = min(before_x[index], batch.rect_x[index])
+            y = min(before_y[index], batch.rect_y[index])
+            width = abs(batch.rect_x[index] - before_x[index]) + batch.width
+            height = abs(batch.rect_y[index] - before_y[index]) + batch.height
+            for cell in touched_goals(goals, x, y, width, height):
+                hits.append((start_index[index], move_index[index], taken, cell))
+
+        # Jumps end when the player is back on the ground, walks when the direction is let go
+        airborne |= ~batch.grounded
+        jump_failed = jump & (frame == 0) & batch.grounded
+        finished = np.where(jump, airborne, taken >= hold) & batch.grounded
+        landed = active & ~won & ~batch.dead & ~jump_failed & finished
+        if landed.any():
+            indices = np.flatnonzero(landed)
+            landed_states = zip(*(column.tolist() for column in batch.take(indices).values()))
+            for index, state in zip(indices, landed_states):
+                landings.append((start_index[index], move_index[index], taken, state))
+
+        # Finished moves are frozen by marking them dead, the batch only steps live players
+        active &= ~(won | batch.dead | jump_failed | landed)
+        batch.dead |= ~active
+        if not active.any():
+            break
+    return landings, hits
+
+
+def search(world_data, TILE_SIZE=32, world_size=None):
+    """fastest route to every goal tile, returns (goal routes, landing spots found)
+
+    goal routes maps each goal cell to (frames, route) or None when it cant be reached"""
+    batch = BatchPhysics(1, world_data, TILE_SIZE)
+    if world_size is not None:
+        batch.reference.world_width, batch.reference.world_height = world_size
+    goals = goal_cells(batch)
+
+    # Landing spots and goals as (frames, state, key of the spot moved from, move, frames the move took)
+    best = {}
+    best_goals = {}
+
+    spawn = tuple(column.tolist()[0] for column in batch.take([0]).values())
+    starts = [(None, 0, spawn)]
+    moves = [SPAWN_MOVE]
+    while starts:
+        landings, hits = run_moves(batch, starts, moves, goals)
+
+        for start, move, taken, cell in hits:
+            key, frames = starts[start][:2]
+            frames += taken
+            if cell not in best_goals or frames < best_goals[cell][0]:
+                best_goals[cell] = (frames, None, key, moves[move], taken)
+
+        improved = {}
+        for start, move, taken, state in landings:
+            key, frames = starts[start][:2]
+            frames += taken
+            landing = landing_key(state)
+            if frames <= MAX_ROUTE_FRAMES and (landing not in best or frames < best[landing][0]):
+                best[landing] = (frames, state, key, moves[move], taken)
+                improved[landing] = True
+
+        starts = [(landing, best[landing][0], best[landing][1]) for landing in improved]
+        moves = MOVES
+
+    routes = {}
+    for cell in sorted((x, y) for x, y, *box in goals):
+        if cell in best_goals:
+            routes[cell] = (best_goals[cell][0], route(best, best_goals[cell]))
+        else:
+            routes[cell] = None
+    return routes, len(best)
+
+
+def route(best, end):
+    """inputs from the spawn to the end of a move as (input, frames) runs"""
+    moves = []
+    while end is not None:
+        frames, state, key, move, taken = end
+        moves.append((move, taken))
+        end = best[key] if key is not None else None
+
+    runs = []
+    for (direction, jump, hold), taken in reversed(moves):
+        hold = min(hold or taken, taken)
+        if jump:
+            parts = [(direction | INPUT_JUMP, 1), (direction, hold - 1), (0, taken - hold)]
+        else:
+            parts = [(direction, hold), (0, taken - hold)]
+
+        for inputs, frames in parts:
+            if not frames:
+                continue
+            if runs and runs[-1][0] == inputs:
+                runs[-1] = (inputs, runs[-1][1] + frames)
+            else:
+                runs.append((inputs, frames))
+    return runs
+
+
+def route_inputs(runs):
+    """per frame inputs of a route"""
+    return [inputs for inputs, frames in runs for _ in range(frames)]
+
+
+def format_route(runs):
+    """short text for a route, like R*30 RJ*1 R*20"""
+    names = {0: "-", INPUT_LEFT: "L", INPUT_RIGHT: "R", INPUT_JUMP: "J"}
+    def name(inputs):
+        return "".join(names[bit] for bit in (INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP) if inputs & bit) or "-"
+    return " ".join(f"{name(inputs)}*{frames}" for inputs, frames in runs)
+
+
+def analyze_level(path, level=None):
+    """check one level file, returns a report"""
+    start = time.perf_counter()
+    world_data, tileset = level_format.read_level(path)
+
+    # Chunked levels are as big as their grid, the others as big as the screen
+    world_size = None
+    if path.endswith(level_format.CHUNKED_EXTENSION):
+        world_size = (world_data.cols * 32, world_data.rows * 32)
+
+    routes, landings = search(world_data, world_size=world_size)
+    return {
+        "path": path,
+        "level": level,
+        "routes": routes,
+        "landings": landings,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def unreachable(report):
+    """goal cells of a report that cant be reached"""
+    return [cell for cell, found in report["routes"].items() if found is None]
+
+
+def format_report(report, show_routes=False):
+    """text lines describing a report"""
+    name = f"level {report['level']}" if report["level"] is not None else report["path"]
+    lines = [f"{name}: {report['landings']} landing spots searched in {report['seconds']:.2f} s"]
+    if not report["routes"]:
+        lines.append("  no goal tile")
+    for cell, found in report["routes"].items():
+        if found is None:
+            lines.append(f"  goal {cell} UNREACHABLE")
+        else:
+            frames, runs = found
+            lines.append(f"  goal {cell} reached in {frames} frames ({frames / FPS:.2f} s)")
+            if show_routes:
+                lines.append(f"    {format_route(runs)}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="check that every level can be completed")
+    parser.add_argument("directory", nargs="?", default="./levels") # directory with the levels
+    parser.add_argument("--jobs", "-j", type=int) # worker processes, one per CPU by default
+    parser.add_argument("--routes") # save the fastest route to each goal as a run log in this directory
+    parser.add_argument("--verbose", "-v", action="store_true") # print the inputs of every route
+    args = parser.parse_args()
+
+    levels = level_format.list_levels(args.directory)
+    paths = [level_format.level_path(level, args.directory) for level in levels]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        reports = list(pool.map(analyze_level, paths, levels))
+
+    failed = 0
+    for report in reports:
+        print("\n".join(format_report(report, args.verbose)))
+        if unreachable(report) or not report["routes"]:
+            failed += 1
+
+        if args.routes:
+            os.makedirs(args.routes, exist_ok=True)
+            for (x, y), found in report["routes"].items():
+                if found is not None:
+                    path = os.path.join(args.routes, f"level{report['level']}_goal{x}_{y}{replay.EXTENSION}")
+                    replay.save_run(path, report["level"], route_inputs(found[1]))
+
+    print(f"checked {len(reports)} levels in {time.perf_counter() - start:.2f} s, {failed} with unreachable goals")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
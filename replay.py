@@ -0,0 +1,201 @@
+"""Recorded runs, the per frame input of one attempt at a level
+
+A run log is a small header followed by the inputs run length encoded:
+
+    magic     4 bytes  b"KKRN"
+    version   uint8
+    padding   1 byte
+    level     uint16
+    frames    uint32
+    runs      (input uint8, repeat uint16) pairs until all frames are covered
+
+The version goes up whenever the physics change what the same inputs do, runs recorded with
+other physics dont replay the same and are rejected. Version 2 is the swept tile collisions.
+"""
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+import entities
+import level_format
+from atomic import atomic_write
+from simulation import PlayerPhysics, simulate
+from world import open_world
+
+MAGIC = b"KKRN"
+VERSION = 2
+HEADER = struct.Struct("<4sBxHI")
+RUN = struct.Struct("<BH")
+MAX_REPEAT = 0xFFFF
+EXTENSION = ".kkr"
+
+# Levels parsed by a batch worker process with a player set up for each, by level file
+worker_levels = {}
+
+
+class RunLogError(Exception):
+    """run log is not in a format we can read"""
+
+
+def save_run(path, level, inputs):
+    """write the inputs of a run through a level to a run log"""
+    runs = []
+    for frame_inputs in inputs:
+        if runs and runs[-1][0] == frame_inputs and runs[-1][1] < MAX_REPEAT:
+            runs[-1][1] += 1
+        else:
+            runs.append([frame_inputs, 1])
+
+    atomic_write(path, HEADER.pack(MAGIC, VERSION, level, len(inputs)) + b"".join(RUN.pack(*run) for run in runs))
+
+
+def load_run(path):
+    """read a run log, returns (level, inputs)"""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise RunLogError(f"{path}: file is too short")
+    magic, version, level, frames = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise RunLogError(f"{path}: not a run log")
+    if version > VERSION:
+        raise RunLogError(f"{path}: format version {version} is newer than {VERSION}")
+    if version < VERSION:
+        raise RunLogError(f"{path}: recorded with the physics of version {version}, it wont replay the same with version {VERSION}")
+
+    inputs = []
+    for frame_inputs, repeat in RUN.iter_unpack(data[HEADER.size:]):
+        inputs.extend([frame_inputs] * repeat)
+    if len(inputs) != frames:
+        raise RunLogError(f"{path}: expected {frames} frames, found {len(inputs)}")
+    return level, inputs
+
+
+class RunRecorder:
+    """Records the input of every attempt at a level, one run log per attempt
+
+    The first attempt is saved to path, later ones get a number: run.kkr, run-1.kkr, run-2.kkr"""
+    def __init__(self, path):
+        self.path = path
+        self.attempt = 0
+        self.level = None
+        self.inputs = []
+
+    def start(self, level):
+        """start recording an attempt"""
+        self.level = level
+        self.inputs = []
+
+    def record(self, inputs):
+        """add one frame of input"""
+        if self.level is not None:
+            self.inputs.append(inputs)
+
+    def save(self):
+        """save the current attempt if anything was recorded"""
+        if self.level is None or not self.inputs:
+            return None
+
+        path = self.path
+        if self.attempt:
+            base, extension = os.path.splitext(self.path)
+            path = f"{base}-{self.attempt}{extension}"
+
+        save_run(path, self.level, self.inputs)
+        print(f"saved run of level {self.level} ({len(self.inputs)} frames) to {path}")
+        self.attempt += 1
+        self.level = None
+        return path
+
+
+def outcome(has_won, dead):
+    """one word result of a run"""
+    if has_won:
+        return "won"
+    if dead:
+        return "dead"
+    return "unfinished"
+
+
+def replay_headless(path, directory="./levels"):
+    """replay a run log without a display as fast as possible, returns the result"""
+    level, inputs = load_run(path)
+    world_data = open_world(level_format.level_path(level, directory))
+    level_entities = entities.load(level, directory=directory)
+
+    start = time.perf_counter()
+    physics, frames = simulate(world_data, inputs, entities=level_entities)
+    return run_result(level, inputs, physics, frames, time.perf_counter() - start)
+
+
+def run_result(level, inputs, physics, frames, elapsed):
+    """result of a replayed run"""
+    return {
+        "level": level,
+        "frames": frames,
+        "recorded_frames": len(inputs),
+        "seconds": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else float("inf"),
+        "has_won": physics.has_won,
+        "dead": physics.dead,
+        "outcome": outcome(physics.has_won, physics.dead),
+    }
+
+
+def cached_level(level, directory="./levels"):
+    """world, player and entities for a level, parsed once per worker process"""
+    path = level_format.level_path(level, directory)
+    if path not in worker_levels:
+        world_data = open_world(path)
+        physics = PlayerPhysics(0, 0, 0.5, 0.5)
+        physics.build_tile_hitboxes(world_data, 32)
+        worker_levels[path] = (world_data, physics, entities.load(level, directory=directory))
+    return worker_levels[path]
+
+
+def replay_job(path, directory="./levels"):
+    """replay one run log in a batch worker, a run that cant be loaded gives a result with an error"""
+    try:
+        level, inputs = load_run(path)
+        world_data, physics, level_entities = cached_level(level, directory)
+    except (OSError, ValueError, RunLogError, entities.EntityError) as error:
+        return {"path": path, "error": str(error)}
+
+    physics.reset()
+    if level_entities is not None:
+        level_entities.reset()
+    start = time.perf_counter()
+    physics, frames = simulate(world_data, inputs, physics=physics, entities=level_entities)
+    result = run_result(level, inputs, physics, frames, time.perf_counter() - start)
+    result["path"] = path
+    return result
+
+
+def find_runs(paths):
+    """run logs to replay, directories are searched for run logs"""
+    runs = []
+    for path in paths:
+        if os.path.isdir(path):
+            runs.extend(
+                os.path.join(path, filename) for filename in sorted(os.listdir(path))
+                if filename.endswith(EXTENSION)
+            )
+        else:
+            runs.append(path)
+    return runs
+
+
+def replay_batch(paths, jobs=None, directory="./levels"):
+    """replay many run logs headless across worker processes, returns (results, seconds)
+
+    Workers get the runs in chunks and keep the levels they parse, so a level is read once
+    per worker however many runs go through it"""
+    runs = find_runs(paths)
+    workers = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(runs) // (workers * 4))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(replay_job, runs, [directory] * len(runs), chunksize=chunksize))
+    return results, time.perf_counter() - start
@@ -1,49 +1,125 @@
 import pygame
-import os
-from completed_levels import completed_levels
+import level_format
+import text_cache
+
+# Longest an idle scene blocks waiting for input, in milliseconds
+IDLE_TIMEOUT = 500
+
+
+class Scene:
+    """base for scenes run by SceneManager
+
+    Idle scenes only draw after input and let the manager block until an event arrives,
+    the others get update called every frame"""
+    idle = True
 
-class Standard:
-    """standard scenes"""
     def __init__(self, screen):
-        self.font = pygame.font.Font(None, 74)
-        self.background_color = (0, 0, 0)
-        self.waiting = False
         self.screen = screen
+        self.changed = True
+
+    def enter(self):
+        """called when the scene becomes the current one"""
+        self.changed = True
+
+    def exit(self):
+        """called when another scene takes over"""
+        pass
+
+    def handle_event(self, event):
+        """handle one event, returns the name of the next scene or None to stay"""
+        return None
+
+    def render(self, force=True):
+        """draw the whole scene if it changed, returns True when it was drawn"""
+        return False
+
+    def update(self, full_redraw):
+        """run one frame, returns the name of the next scene or None to stay"""
+        return None
+
+
+class SceneManager:
+    """Holds every scene by name and switches between them, scenes are built once and reused"""
+    def __init__(self, scenes, current, idle_timeout=IDLE_TIMEOUT):
+        self.scenes = scenes
+        self.idle_timeout = idle_timeout
+        self.name = current
+        self.current = scenes[current]
+        self.current.enter()
+
+    def switch(self, name):
+        """exit the current scene and enter another"""
+        self.current.exit()
+        self.name = name
+        self.current = self.scenes[name]
+        self.current.enter()
+
+    def events(self):
+        """pending events, idle scenes with nothing new to draw wait for one instead of polling"""
+        if not self.current.idle or self.current.changed:
+            return pygame.event.get()
+
+        event = pygame.event.wait(self.idle_timeout)
+        if event.type == pygame.NOEVENT:
+            return []
+        return [event] + pygame.event.get()
+
+    def handle_event(self, event):
+        next_scene = self.current.handle_event(event)
+        if next_scene is not None:
+            self.switch(next_scene)
+
+    def render(self, force=True):
+        return self.current.render(force)
+
+    def update(self, full_redraw):
+        next_scene = self.current.update(full_redraw)
+        if next_scene is not None:
+            self.switch(next_scene)
+
+
+class Standard(Scene):
+    """info screen in one color that moves on to the next scene when any key is pressed"""
+    def __init__(self, screen, text, color, next_scene="select"):
+        super().__init__(screen)
+        self.font = text_cache.font(None, 74)
+        self.background_color = (0, 0, 0)
+        self.next_scene = next_scene
+        self.text = text
+        self.color = color
+
+    def render(self, force=True):
+        """shows the text and the press any key to continue text"""
+        if not force and not self.changed:
+            return False
+        self.changed = False
 
-    def text_and_continue(self, text, color):
-        """shows a short info screen in desired color with an option to move onwards by pressing any key"""
         self.screen.fill(self.background_color)
 
         # Render text
-        text_surface = self.font.render(text, True, color)
+        text_surface = text_cache.render(self.font, self.text, self.color)
         text_rect = text_surface.get_rect(center=(self.screen.get_width() // 2, self.screen.get_height() // 2))
         self.screen.blit(text_surface, text_rect)
-    
+
         # Render "Press any key to continue" text
-        subtext_surface = self.font.render("Press any key to continue", True, color)
+        subtext_surface = text_cache.render(self.font, "Press any key to continue", self.color)
         subtext_rect = subtext_surface.get_rect(center=(self.screen.get_width() // 2, self.screen.get_height() // 2 + 50))
         self.screen.blit(subtext_surface, subtext_rect)
-    
-        # Update the display
-        pygame.display.flip()
-    
-        # Wait for any key press
-        self.waiting = True
-        while self.waiting:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    exit()
-                if event.type == pygame.KEYDOWN:
-                    waiting = False
-                    return True
-
-
-class LevelMenu:
-    """menu for selecting levels"""
-    def __init__(self, screen):
-        self.font = pygame.font.Font(None, 74)
-        self.small_font = pygame.font.Font(None, 36)
+        return True
+
+    def handle_event(self, event):
+        """any key continues"""
+        if event.type == pygame.KEYDOWN:
+            return self.next_scene
+        return None
+
+
+class LevelMenu(Scene):
+    """menu for selecting levels from the progress store, prefetch is called with the level under the cursor"""
+    def __init__(self, screen, progress, prefetch=None):
+        super().__init__(screen)
+        self.font = text_cache.font(None, 74)
+        self.small_font = text_cache.font(None, 36)
         self.text_color = (255, 255, 255)
         self.background_color = (0, 0, 0)
 
@@ -51,43 +127,45 @@ class LevelMenu:
         self.not_done_color = (0, 0, 0)
         self.not_allowed_color = (255, 0, 0)
 
-        self.screen = screen
+        self.progress = progress
         self.levels = self.load_levels()
         self.selected_index = 0
+        self.prefetch = prefetch
 
 
     def load_levels(self):
         """load levels from path into list"""
-        level_files = len(os.listdir("./levels/"))
-        levels = []
-        for i in range(level_files):
-            levels.append(str(i))
-        levels = sorted(levels)
-        return levels
+        return [str(level) for level in level_format.list_levels("./levels/")]
 
     def handle_event(self, event):
-        """handle changing of levels with arrowkeys"""
+        """handle changing of levels with arrowkeys, returns "game" when a level is selected"""
         if event.type == pygame.KEYDOWN:
+            self.changed = True
             if event.key == pygame.K_UP:
                 self.selected_index = (self.selected_index + 1) % len(self.levels)
             elif event.key == pygame.K_DOWN:
                 self.selected_index = (self.selected_index - 1) % len(self.levels)
             elif event.key == pygame.K_RETURN:
                 # If previous level hasnt been completed dont allow selecting it
-                if self.selected_index -1 in completed_levels or self.selected_index == 0:
-                    self.active = False
-                    return self.selected_index
+                if self.progress.unlocked(self.selected_index):
+                    return "game"
+            if self.prefetch:
+                self.prefetch(self.selected_index)
         return None
 
-    def render(self):
-        """render the menu to the screen"""
+    def render(self, force=True):
+        """render the menu to the screen if it changed, returns True when it was drawn"""
+        if not force and not self.changed:
+            return False
+        self.changed = False
+
         self.screen.fill(self.background_color)
 
         # Correct color and text based on completion of level
-        if self.selected_index in completed_levels:
+        if self.progress.completed(self.selected_index):
             selected_text = self.completed_color
             completed_text = "Completed"
-        elif self.selected_index -1 not in completed_levels and self.selected_index != 0:
+        elif not self.progress.unlocked(self.selected_index):
             selected_text = self.not_allowed_color
             completed_text = "Not unlocked"
         else:
@@ -95,30 +173,41 @@ class LevelMenu:
             completed_text = "Not completed"
 
         # Render completed text
-        text_surface = self.font.render(completed_text, True, selected_text)
+        text_surface = text_cache.render(self.font, completed_text, selected_text)
         text_rect = text_surface.get_rect(center=(self.screen.get_width() // 2, self.screen.get_height() // 2 - 120))
         self.screen.blit(text_surface, text_rect)
         
         # Render level number
-        text_surface = self.font.render(str(self.selected_index), True, self.text_color)
+        text_surface = text_cache.render(self.font, str(self.selected_index), self.text_color)
         text_rect = text_surface.get_rect(center=(self.screen.get_width() // 2, self.screen.get_height() // 2))
         self.screen.blit(text_surface, text_rect)
-    
+
+        # Render best time and deaths
+        stats = []
+        best_time = self.progress.best_time(self.selected_index)
+        if best_time is not None:
+            stats.append(f"Best time {best_time:.2f} s")
+        deaths = self.progress.deaths(self.selected_index)
+        if deaths:
+            stats.append(f"Deaths {deaths}")
+        if stats:
+            text_surface = text_cache.render(self.small_font, "   ".join(stats), self.text_color)
+            text_rect = text_surface.get_rect(center=(self.screen.get_width() // 2, self.screen.get_height() // 2 + 80))
+            self.screen.blit(text_surface, text_rect)
+
         # Render "Press any key to continue" text
-        subtext_surface = self.small_font.render("Change with arrow keys\nSelect with return", True, self.text_color)
+        subtext_surface = text_cache.render_lines(self.small_font, "Change with arrow keys\nSelect with return", self.text_color, align="center")
         subtext_rect = subtext_surface.get_rect(center=(self.screen.get_width() // 2, self.screen.get_height() // 2 + 200))
         self.screen.blit(subtext_surface, subtext_rect)
+        return True
 
-        pygame.display.flip()
-
-class Intro:
+class Intro(Scene):
     """intro text for the game"""
     def __init__(self, screen):
-            self.font = pygame.font.Font(None, 32)
+            super().__init__(screen)
+            self.font = text_cache.font(None, 32)
             self.background_color = (0, 0, 0)
             self.text_color = (255, 255, 255)
-            self.waiting = False
-            self.screen = screen
 
             self.slides = [
                 """
@@ -152,26 +241,30 @@ class Intro:
             ]
             self.current_slide = 0
 
-    def render_slide(self):
-        """Renders the current slide."""
+    def render(self, force=True):
+        """Renders the current slide if it changed, returns True when it was drawn"""
+        if not force and not self.changed:
+            return False
+        self.changed = False
+
         self.screen.fill(self.background_color)
         slide_text = self.slides[self.current_slide]
 
-        text_surface = self.font.render(slide_text, True, self.text_color)
-        text_rect = text_surface.get_rect(center=(self.screen.get_width() // 2 - 43, self.screen.get_height() // 2))
+        text_surface = text_cache.render_lines(self.font, slide_text, self.text_color)
+        text_rect = text_surface.get_rect(center=(self.screen.get_width() // 2, self.screen.get_height() // 2))
         self.screen.blit(text_surface, text_rect)
 
         # Render press any key to continue text
-        subtext_surface = self.font.render("Press any key to continue", True, self.text_color)
+        subtext_surface = text_cache.render(self.font, "Press any key to continue", self.text_color)
         subtext_rect = subtext_surface.get_rect(center=(self.screen.get_width() // 2, self.screen.get_height() // 2 + 200))
         self.screen.blit(subtext_surface, subtext_rect)
-
-        pygame.display.flip()
+        return True
 
     def handle_event(self, event):
-        """handles events for switchins slides"""
+        """handles events for switchins slides, returns "select" when the intro is complete"""
         if event.type == pygame.KEYDOWN:
+            self.changed = True
             self.current_slide += 1
             if self.current_slide >= len(self.slides):
-                return True  # Intro is complete
-        return False
\ No newline at end of file
+                return "select"
+        return None
\ No newline at end of file
@@ -0,0 +1,430 @@
+import pygame
+import os
+import tiles
+
+# Input bitmask used by the simulation instead of pygame key state
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+
+# Player animations, the simulation only needs to know how many frames each has
+ANIMATION_PATHS = {
+    "idle": "./assets/images/player/idle",
+    "run": "./assets/images/player/run",
+    "jump": "./assets/images/player/jump",
+    "death": "./assets/images/player/death",
+}
+
+# Size of the players hitbox (scaled sprite inflated by -30, -20)
+HITBOX_SIZE = (34, 44)
+
+# Simulated frames per second, the animation clock advances 1000 / FPS ms per frame
+FPS = 60
+
+# Collision sweeps per frame, more substeps split each frames movement into smaller moves
+SUBSTEPS = 1
+
+
+def frame_ticks(frame):
+    """whole milliseconds at a frame, like pygame.time.get_ticks"""
+    return frame * 1000 // FPS
+
+
+def inputs_from_keys(keys):
+    """convert pygame key state to an input bitmask"""
+    inputs = 0
+    if keys[pygame.K_LEFT]:
+        inputs |= INPUT_LEFT
+    if keys[pygame.K_RIGHT]:
+        inputs |= INPUT_RIGHT
+    if keys[pygame.K_SPACE]:
+        inputs |= INPUT_JUMP
+    return inputs
+
+
+def count_animation_frames(path):
+    """count animation frames in a directory without loading them"""
+    return len([filename for filename in os.listdir(path) if filename.endswith(".png")])
+
+
+class PlayerPhysics:
+    """Movement, collision and win/death logic for the player, runs without a display"""
+    def __init__(self, x, y, acceleration, gravity, frame_counts=None, hitbox_size=HITBOX_SIZE, substeps=SUBSTEPS):
+        self.vec = pygame.math.Vector2
+
+        self.pos = self.vec(x, y)
+        self.vel = self.vec(0, 0)
+        self.acc = self.vec(0, 0)
+
+        self.acceleration = acceleration
+        self.gravity = gravity
+        self.friction = -0.13
+        self.substeps = substeps
+
+        # set default values
+        self.grounded = False
+        self.is_jumping = False
+        self.has_won = False
+        self.dead = False
+        self.dead_screen = False
+        self.is_playing_jump_animation = False
+
+        # Which tiles are solid, deadly or the goal, and their hitbox shapes
+        self.tile_types = tiles.load()
+
+        # Hitboxes for the current level, built by build_tile_hitboxes
+        self.tile_hitboxes = []
+        self.hitbox_world = None
+        self.hitbox_tile_size = None
+
+        # Size of the world in pixels, walking past the sides is blocked and falling below kills
+        self.world_width = 960
+        self.world_height = 540
+
+        # Animation state, jumping and the death screen depend on it
+        if frame_counts is None:
+            frame_counts = {name: count_animation_frames(path) for name, path in ANIMATION_PATHS.items()}
+        self.frame_counts = frame_counts
+        self.current_animation = "idle"
+        self.current_frame = 0
+        self.animation_timer = 0
+        self.animation_speed = 100  # Time in milliseconds per frame
+
+        # Frames simulated since the last reset, used as the animation clock
+        self.frame_counter = 0
+
+        self.rect = pygame.Rect(x, y, *hitbox_size)
+
+    def reset(self, x=0, y=0):
+        """reset player to start with atrributes"""
+        self.pos = self.vec(x, y)
+        self.vel = self.vec(0, 0)
+        self.acc = self.vec(0, 0)
+        self.rect.topleft = (x, y)
+        self.grounded = False
+        self.is_jumping = False
+        self.has_won = False
+        self.dead = False
+        self.dead_screen = False
+        self.is_playing_jump_animation = False
+
+        # Restart animations so a run plays out the same every time
+        self.current_animation = "idle"
+        self.current_frame = 0
+        self.animation_timer = 0
+        self.frame_counter = 0
+
+    def limit_velocity(self, max_vel):
+        """Make sure velocity doesnt spin out of control due to repeated math operations"""
+        self.vel.x = max(-max_vel, min(self.vel.x, max_vel))
+        if abs(self.vel.x) < .01: self.vel.x = 0
+
+    def horizontal_movement(self, inputs):
+        """Detects movment input and updates velocity, the move itself is done by move_and_collide"""
+        self.acc.x = 0
+        if inputs & INPUT_LEFT:
+            self.acc.x = -self.acceleration
+        elif inputs & INPUT_RIGHT:
+            self.acc.x = self.acceleration
+        else:
+            self.acc.x = 0
+
+        # Clean up after movement
+        self.acc.x += self.vel.x * self.friction
+        self.vel += self.acc
+        self.limit_velocity(4)
+
+    def vertical_movement(self, inputs):
+        """Detects jumping and operates gravity logic"""
+        self.acc.y = self.gravity
+
+        if inputs & INPUT_JUMP and self.grounded and not self.is_playing_jump_animation:
+            self.vel.y = -12  # Jump velocity
+            self.grounded = False
+            self.is_playing_jump_animation = True  # Start jump animation
+            self.current_animation = "jump"
+            self.current_frame = 0  # Reset jump animation to the beginning
+
+    def tile_hitbox(self, tile, x, y, TILE_SIZE):
+        """Hitbox of one tile as (tile, rect), None for empty cells"""
+        if tile < 0:
+            return None
+
+        # Hitbox shape comes from the tile manifest, deadly tiles have smaller ones
+        return (tile, pygame.Rect(self.tile_types.hitbox(tile, x, y, TILE_SIZE)))
+
+    def build_tile_hitboxes(self, world_data, TILE_SIZE):
+        """Precompute a hitbox grid for the level so collisions dont rebuild rects every frame"""
+        if hasattr(self.hitbox_world, "unsubscribe"):
+            self.hitbox_world.unsubscribe(self.tiles_changed)
+
+        if hasattr(world_data, "hitbox_grid"):
+            # Chunked worlds build hitboxes per chunk as chunks are loaded
+            hitboxes = world_data.hitbox_grid(self.tile_hitbox)
+            self.world_width = world_data.width
+            self.world_height = world_data.height
+        else:
+            hitboxes = [
+                [self.tile_hitbox(tile, x, y, TILE_SIZE) for x, tile in enumerate(row)]
+                for y, row in enumerate(world_data)
+            ]
+            if hasattr(world_data, "subscribe"):
+                # Tiles changed in a TileMap only rebuild their own hitboxes
+                world_data.subscribe(self.tiles_changed)
+
+        self.tile_hitboxes = hitboxes
+        self.hitbox_world = world_data
+        self.hitbox_tile_size = TILE_SIZE
+        return hitboxes
+
+    def tiles_changed(self, x, y, width, height):
+        """Rebuild the hitboxes of a region of cells changed in the TileMap they were built from"""
+        world_data = self.hitbox_world
+        for row in range(y, y + height):
+            tiles_row = world_data[row]
+            hitboxes = self.tile_hitboxes[row]
+            for column in range(x, x + width):
+                hitboxes[column] = self.tile_hitbox(tiles_row[column], column, row, self.hitbox_tile_size)
+
+    def tiles_in_area(self, left, top, right, bottom, world_data, TILE_SIZE):
+        """Hitboxes of the tiles in the grid cells an area in pixels covers"""
+        if self.hitbox_world is not world_data:
+            self.build_tile_hitboxes(world_data, TILE_SIZE)
+
+        hitboxes = self.tile_hitboxes
+        if not hitboxes:
+            return []
+
+        first_col = max(int(left // TILE_SIZE), 0)
+        last_col = min(int(-(-right // TILE_SIZE)) - 1, len(hitboxes[0]) - 1)
+        first_row = max(int(top // TILE_SIZE), 0)
+        last_row = min(int(-(-bottom // TILE_SIZE)) - 1, len(hitboxes) - 1)
+
+        found = []
+        for y in range(first_row, last_row + 1):
+            row = hitboxes[y]
+            for x in range(first_col, last_col + 1):
+                hitbox = row[x]
+                if hitbox is not None:
+                    found.append(hitbox)
+        return found
+
+    def get_tile_collisions(self, world_data, TILE_SIZE):
+        """Detect collision against the tiles in the grid cells the player overlaps"""
+        tiles_near = self.tiles_in_area(
+            self.rect.left, self.rect.top, self.rect.right, self.rect.bottom, world_data, TILE_SIZE
+        )
+        return [hitbox for hitbox in tiles_near if self.rect.colliderect(hitbox[1])]
+
+    def check_tile(self, tile):
+        """checks if collision tile has specific attributes"""
+        tile_types = self.tile_types
+
+        if tile_types.goal[tile]:  # win button
+            self.has_won = True  # Set a flag to indicate level completion
+
+        elif tile_types.deadly[tile]:
+            self.dead = True # Set flag to indicate death globally
+
+        # Only solid tiles push the player back
+        return not tile_types.solid[tile]
+
+    def sweep(self, dx, dy, world_data, TILE_SIZE):
+        """Move the hitbox along one axis (dx or dy is 0) and stop at the first solid tile in the way
+
+        The time of impact with a tile is the gap to it divided by the distance moved, so a fast
+        move cant skip over a thin tile. Tiles touched on the way are checked for goal and death.
+        Returns 1 if a tile was hit moving right or down, -1 moving left or up, otherwise 0"""
+        distance = dx or dy
+        if not distance:
+            return 0
+
+        x, y = self.pos.x, self.pos.y
+        width, height = self.rect.size
+
+        # Broad phase over the cells between where the hitbox starts and ends
+        tiles_near = self.tiles_in_area(
+            x + min(dx, 0), y + min(dy, 0), x + width + max(dx, 0), y + height + max(dy, 0),
+            world_data, TILE_SIZE
+        )
+
+        solid = self.tile_types.solid
+        first_impact = None
+        hits = []
+        for tile, tile_rect in tiles_near:
+            if not solid[tile]:
+                continue
+
+            # Only tiles overlapping on the other axis and ahead of the hitbox are in the way
+            if dx:
+                in_line = y < tile_rect.bottom and y + height > tile_rect.top
+                gap = tile_rect.left - (x + width) if dx > 0 else x - tile_rect.right
+            else:
+                in_line = x < tile_rect.right and x + width > tile_rect.left
+                gap = tile_rect.top - (y + height) if dy > 0 else y - tile_rect.bottom
+            if not in_line or gap < 0:
+                continue
+
+            impact = gap / abs(distance)
+            if impact > 1:
+                continue
+            if first_impact is None or impact < first_impact:
+                first_impact = impact
+                hits = [(tile, tile_rect)]
+            elif impact == first_impact:
+                hits.append((tile, tile_rect))
+
+        if hits:
+            # Stop flush against the tile
+            tile_rect = hits[0][1]
+            if dx > 0:
+                x = tile_rect.left - width
+            elif dx < 0:
+                x = tile_rect.right
+            elif dy > 0:
+                y = tile_rect.top - height
+            else:
+                y = tile_rect.bottom
+        else:
+            x += dx
+            y += dy
+
+        # Tiles stopped against or overlapped anywhere along the move
+        left, right = min(self.pos.x, x), max(self.pos.x, x) + width
+        top, bottom = min(self.pos.y, y), max(self.pos.y, y) + height
+        for tile, tile_rect in hits:
+            self.check_tile(tile)
+        for tile, tile_rect in tiles_near:
+            if left < tile_rect.right and right > tile_rect.left and top < tile_rect.bottom and bottom > tile_rect.top:
+                self.check_tile(tile)
+
+        self.pos.x = x
+        self.pos.y = y
+        if not hits:
+            return 0
+        return 1 if distance > 0 else -1
+
+    def move_and_collide(self, world_data, TILE_SIZE):
+        """Move by this frames velocity in substeps, each sweeping x and then y against the tiles"""
+        self.grounded = False
+
+        dx, dy = self.vel + 0.5 * self.acc
+        for _ in range(self.substeps):
+            self.sweep(dx / self.substeps, 0, world_data, TILE_SIZE)
+
+            side = self.sweep(0, dy / self.substeps, world_data, TILE_SIZE)
+            if side > 0:  # Landed on a tile
+                self.grounded = True
+                self.is_jumping = False
+                self.vel.y = 0
+            elif side < 0:  # Hit a tile from the bottom
+                self.vel.y = 0
+
+        self.rect.topleft = self.pos
+
+    def animate(self, current_time):
+        """Handles frame updates for animations, returns True when the frame changed"""
+        if current_time - self.animation_timer <= self.animation_speed:
+            return False
+
+        self.animation_timer = current_time
+
+        if self.current_animation == "jump" and self.is_playing_jump_animation:
+            # Play jump animation once
+            self.current_frame += 1
+            if self.current_frame >= self.frame_counts["jump"]:
+                self.current_frame = self.frame_counts["jump"] - 1  # Stay on the last frame
+                self.is_playing_jump_animation = False  # End jump animation
+
+        elif self.current_animation == "death":
+            # Play jump animation once
+            self.current_frame += 1
+            if self.current_frame >= self.frame_counts["death"]:
+                self.current_frame = self.frame_counts["death"] - 1  # Stay on the last frame
+                self.dead_screen = True
+
+        else:
+            # Loop other animations
+            self.current_frame = (self.current_frame + 1) % self.frame_counts[self.current_animation]
+        return True
+
+    def check_map_boundaries(self):
+        """checks and corrects player if they go to far to left or right"""
+        if self.rect.left < 0:
+            self.rect.left = 0
+            self.pos.x = self.rect.x
+        elif self.rect.right > self.world_width:
+            self.rect.right = self.world_width
+            self.pos.x = self.rect.x
+
+    def check_fall_death(self):
+        """kills player if they fall out of map"""
+        if self.rect.top > self.world_height:  # If the player falls below the map
+            self.dead = True  # Player dies from falling
+            self.current_animation = "death"
+            self.is_playing_jump_animation = False  # End jump animation if falling
+
+    def step(self, inputs, world_data, TILE_SIZE, ticks):
+        """Advance the simulation one frame with an input bitmask at the given time in milliseconds,
+        returns True when the animation frame changed"""
+        if not self.dead:
+            self.horizontal_movement(inputs)
+            self.vertical_movement(inputs)
+            self.move_and_collide(world_data, TILE_SIZE)
+
+            self.pos.x = self.rect.x
+            self.pos.y = self.rect.y
+
+            self.check_fall_death()
+            self.check_map_boundaries()
+
+        # Determine animation state
+        if self.dead:
+            self.current_animation = "death"
+        elif self.is_playing_jump_animation:
+            self.current_animation = "jump"
+        elif self.vel.x != 0:
+            self.current_animation = "run"
+        else:
+            self.current_animation = "idle"
+
+        # Update animation frame
+        return self.animate(ticks)
+
+
+    def tick(self, inputs, world_data, TILE_SIZE):
+        """Advance one frame, timing animations by the frame counter instead of the wall clock"""
+        self.frame_counter += 1
+        return self.step(inputs, world_data, TILE_SIZE, frame_ticks(self.frame_counter))
+
+
+def simulate(world_data, inputs, TILE_SIZE=32, max_frames=None, physics=None, entities=None):
+    """Run the player through a level headless
+
+    inputs is an iterable of input bitmasks, one per frame. Stops when the level is won,
+    the death animation has finished, the inputs run out or max_frames is reached.
+    entities is the levels EntityStore, if it has one. Chunked worlds are streamed around the
+    player, so only the chunks near it are kept however far it goes.
+    Returns the physics state and number of frames simulated"""
+    if physics is None:
+        physics = PlayerPhysics(0, 0, 0.5, 0.5)
+    if physics.hitbox_world is not world_data:
+        physics.build_tile_hitboxes(world_data, TILE_SIZE)
+
+    chunked = hasattr(world_data, "follow")
+
+    frames = 0
+    for frame_inputs in inputs:
+        if max_frames is not None and frames >= max_frames:
+            break
+        frames += 1
+        if chunked:
+            world_data.follow(physics.rect)
+        if entities is not None:
+            entities.update(physics)
+        physics.tick(frame_inputs, world_data, TILE_SIZE)
+        if entities is not None:
+            entities.collide(physics)
+        if physics.has_won or physics.dead_screen:
+            break
+    return physics, frames
@@ -0,0 +1,80 @@
+import textwrap
+from collections import OrderedDict
+import pygame
+
+class TextCache:
+    """Rendered text surfaces in an LRU cache keyed by (font, text, color, antialias)
+
+    Surfaces are shared between everyone drawing the same text, so they must not be drawn on"""
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+
+        # key -> surface, least recently used first
+        self.cache = OrderedDict()
+
+    def get(self, key, make):
+        """cached surface for a key, made with make() when it isnt cached"""
+        surface = self.cache.get(key)
+        if surface is None:
+            surface = make()
+            self.cache[key] = surface
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+        return surface
+
+    def render(self, font, text, color, antialias=True):
+        """one line of text, like font.render"""
+        key = (font, text, tuple(color), antialias)
+        return self.get(key, lambda: font.render(text, antialias, color))
+
+    def render_lines(self, font, text, color, antialias=True, align="left"):
+        """text with several lines, indentation shared by every line and blank first and last lines are removed
+
+        align is left, center or right within the widest line"""
+        key = (font, text, tuple(color), antialias, align)
+        return self.get(key, lambda: self.layout(font, text, color, antialias, align))
+
+    def layout(self, font, text, color, antialias, align):
+        """render every line and stack them on one transparent surface"""
+        lines = textwrap.dedent(text).strip("\n").split("\n")
+        images = [self.render(font, line.rstrip(), color, antialias) for line in lines]
+
+        line_height = font.get_linesize()
+        width = max(image.get_width() for image in images)
+        surface = pygame.Surface((max(width, 1), max(line_height * len(images), 1)), pygame.SRCALPHA)
+
+        for i, image in enumerate(images):
+            rect = image.get_rect(top=i * line_height)
+            if align == "center":
+                rect.centerx = width // 2
+            elif align == "right":
+                rect.right = width
+            surface.blit(image, rect)
+        return surface
+
+
+# Shared by every scene and the editor
+cache = TextCache()
+
+# Fonts by (name, size), so the same text in the same font is cached once
+fonts = {}
+
+
+def font(name, size):
+    """shared font, loaded the first time it is asked for"""
+    key = (name, size)
+    if key not in fonts:
+        fonts[key] = pygame.font.Font(name, size)
+    return fonts[key]
+
+
+def render(font, text, color, antialias=True):
+    """one line of text from the shared cache"""
+    return cache.render(font, text, color, antialias)
+
+
+def render_lines(font, text, color, antialias=True, align="left"):
+    """several lines of text from the shared cache"""
+    return cache.render_lines(font, text, color, antialias, align)
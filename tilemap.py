@@ -0,0 +1,191 @@
+"""Tile grid of a level kept in one contiguous array
+
+A TileMap stores one byte per tile, row after row (two once a tile id above 127 is stored), instead of a list of lists of ints. It
+still indexes like the old world_data, world_data[y][x] is the tile at column x and row y,
+but rows are read only views, tiles are changed through set, fill, paste and replace so
+everything that caches something about the tiles hears about the cells that changed.
+"""
+import array
+import numpy as np
+
+EMPTY = -1
+
+# Empty cell in levels stored one unsigned byte per tile, like level_format.UINT8_EMPTY
+UNSIGNED_EMPTY = 255
+
+
+def typecode_for(highest):
+    """smallest array type holding tile ids up to highest"""
+    return "b" if highest <= 127 else "h"
+
+
+class TileMap:
+    """Fixed size grid of tile ids, -1 is an empty cell
+
+    Callbacks added with subscribe are called as callback(x, y, width, height) with the
+    region of cells that changed"""
+    __slots__ = ("cols", "rows", "tiles", "view", "listeners")
+
+    def __init__(self, cols, rows, fill=EMPTY, typecode="b", tiles=None):
+        self.cols = cols
+        self.rows = rows
+        if tiles is None:
+            tiles = array.array(typecode, [fill]) * (cols * rows)
+        elif len(tiles) != cols * rows:
+            raise ValueError(f"{len(tiles)} tiles for a {cols}x{rows} map")
+        self.tiles = tiles
+        self.view = memoryview(self.tiles).toreadonly()
+        self.listeners = []
+
+    @classmethod
+    def from_rows(cls, rows, cols=None):
+        """tile map holding a list of rows, short rows are padded with empty cells"""
+        rows = [list(row) for row in rows]
+        if cols is None:
+            cols = max((len(row) for row in rows), default=0)
+        highest = max((max(row, default=EMPTY) for row in rows), default=EMPTY)
+        tiles = array.array(typecode_for(highest))
+        for row in rows:
+            row = row[:cols]
+            tiles.extend(row)
+            tiles.extend([EMPTY] * (cols - len(row)))
+        return cls(cols, len(rows), tiles=tiles)
+
+    @classmethod
+    def from_bytes(cls, cols, rows, data, unsigned=False):
+        """tile map from one byte per tile, row by row
+
+        Signed bytes hold tiles up to 127 with -1 empty, unsigned bytes tiles up to 254 with 255 empty"""
+        if unsigned:
+            return cls(cols, rows, tiles=array.array("h", (EMPTY if tile == UNSIGNED_EMPTY else tile for tile in data)))
+        return cls(cols, rows, tiles=array.array("b", data))
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, y):
+        """read only view of row y, no tiles are copied"""
+        return self.row(y)
+
+    def __iter__(self):
+        for y in range(self.rows):
+            yield self.view[y * self.cols:(y + 1) * self.cols]
+
+    def __eq__(self, other):
+        if isinstance(other, TileMap):
+            return (self.cols, self.rows) == (other.cols, other.rows) and self.view == other.view
+        return NotImplemented
+
+    __hash__ = None
+
+    def check(self, x, y):
+        if not (0 <= x < self.cols and 0 <= y < self.rows):
+            raise IndexError(f"cell ({x}, {y}) is outside the {self.cols}x{self.rows} map")
+
+    def fit(self, highest):
+        """widen the storage to two bytes per tile when a tile id doesnt fit in one"""
+        if self.tiles.typecode == "b" and highest > 127:
+            self.tiles = array.array("h", self.tiles)
+            self.view = memoryview(self.tiles).toreadonly()
+
+    def get(self, x, y):
+        """tile at column x and row y"""
+        self.check(x, y)
+        return self.tiles[y * self.cols + x]
+
+    def set(self, x, y, tile):
+        """change one tile, returns the tile it replaced"""
+        self.check(x, y)
+        index = y * self.cols + x
+        old = self.tiles[index]
+        if old != tile:
+            self.fit(tile)
+            self.tiles[index] = tile
+            self.changed(x, y, 1, 1)
+        return old
+
+    def row(self, y):
+        """read only view of row y, no tiles are copied"""
+        if not 0 <= y < self.rows:
+            raise IndexError(f"row {y} is outside the {self.cols}x{self.rows} map")
+        return self.view[y * self.cols:(y + 1) * self.cols]
+
+    def array(self):
+        """read only numpy view of the whole grid with shape (rows, cols)"""
+        return np.frombuffer(self.view, dtype=self.tiles.typecode).reshape(self.rows, self.cols)
+
+    def region(self, x, y, width, height):
+        """read only numpy view of a rectangle of cells, clipped to the map"""
+        return self.array()[max(y, 0):y + height, max(x, 0):x + width]
+
+    def fill(self, tile=EMPTY):
+        """set every tile"""
+        self.fit(tile)
+        self.tiles[:] = array.array(self.tiles.typecode, [tile]) * len(self.tiles)
+        self.changed(0, 0, self.cols, self.rows)
+
+    def paste(self, source, x=0, y=0):
+        """copy rows of tiles, another TileMap or a list of rows, with their top left at (x, y)
+
+        Whatever falls outside the map is left out"""
+        first_x = max(x, 0)
+        first_y = max(y, 0)
+        last_x = first_x
+        last_y = first_y
+        for source_y, source_row in enumerate(source):
+            row = y + source_y
+            if row < 0:
+                continue
+            if row >= self.rows:
+                break
+            part = source_row[first_x - x:self.cols - x]
+            if not len(part):
+                continue
+            self.fit(max(part))
+            start = row * self.cols + first_x
+            self.tiles[start:start + len(part)] = array.array(self.tiles.typecode, part)
+            last_x = max(last_x, first_x + len(part))
+            last_y = row + 1
+
+        if last_x > first_x and last_y > first_y:
+            self.changed(first_x, first_y, last_x - first_x, last_y - first_y)
+
+    def replace(self, source):
+        """make the map hold source from the top left, with the cells it doesnt cover emptied"""
+        listeners = self.listeners
+        self.listeners = []
+        try:
+            self.fill()
+            self.paste(source)
+        finally:
+            self.listeners = listeners
+        self.changed(0, 0, self.cols, self.rows)
+
+    def changes(self, other):
+        """cells where another map of the same size differs, as (x, y, tile in other)"""
+        if (other.cols, other.rows) != (self.cols, self.rows):
+            raise ValueError(f"cant compare a {other.cols}x{other.rows} map with a {self.cols}x{self.rows} map")
+        other_tiles = other.array()
+        ys, xs = np.nonzero(self.array() != other_tiles)
+        return list(zip(xs.tolist(), ys.tolist(), other_tiles[ys, xs].tolist()))
+
+    def copy(self):
+        """tile map with the same tiles and no listeners"""
+        return TileMap(self.cols, self.rows, tiles=array.array(self.tiles.typecode, self.tiles))
+
+    def tobytes(self):
+        return self.tiles.tobytes()
+
+    def subscribe(self, callback):
+        """call callback(x, y, width, height) whenever tiles change"""
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def changed(self, x, y, width, height):
+        """tell the listeners a region of cells changed"""
+        for callback in list(self.listeners):
+            callback(x, y, width, height)
@@ -0,0 +1,71 @@
+import json
+import os
+
+# Tile types in the order of their ids, with their images and how the player interacts with them
+MANIFEST_PATH = "./assets/tiles.json"
+
+# Hitbox as (x, y, width, height) in fractions of a tile, the whole tile unless the manifest says otherwise
+FULL_HITBOX = (0, 0, 1, 1)
+
+# Manifests already compiled in this process
+loaded = {}
+
+
+class TileManifestError(Exception):
+    """tile manifest is missing something or has values we cant use"""
+
+
+class TileTypes:
+    """Tile properties compiled into lookup tables indexed by tile id
+
+    solid, deadly and goal are bytearrays, so checking a tile is one array read"""
+    def __init__(self, tiles, directory):
+        self.names = []
+        self.images = []
+        self.solid = bytearray(len(tiles))
+        self.deadly = bytearray(len(tiles))
+        self.goal = bytearray(len(tiles))
+        self.hitboxes = []
+
+        for tile_id, tile in enumerate(tiles):
+            if "image" not in tile:
+                raise TileManifestError(f"tile {tile_id} has no image")
+            hitbox = tuple(tile.get("hitbox", FULL_HITBOX))
+            if len(hitbox) != 4:
+                raise TileManifestError(f"tile {tile_id}: hitbox must be [x, y, width, height]")
+
+            self.names.append(tile.get("name", str(tile_id)))
+            self.images.append(os.path.join(directory, tile["image"]))
+            self.solid[tile_id] = bool(tile.get("solid", True))
+            self.deadly[tile_id] = bool(tile.get("deadly", False))
+            self.goal[tile_id] = bool(tile.get("goal", False))
+            self.hitboxes.append(hitbox)
+
+    def __len__(self):
+        return len(self.images)
+
+    def hitbox(self, tile, x, y, TILE_SIZE):
+        """(left, top, width, height) in pixels of a tile placed at column x and row y"""
+        left, top, width, height = self.hitboxes[tile]
+        return (
+            x * TILE_SIZE + left * TILE_SIZE,
+            y * TILE_SIZE + top * TILE_SIZE,
+            TILE_SIZE * width,
+            TILE_SIZE * height,
+        )
+
+
+def load(path=MANIFEST_PATH):
+    """read and compile a tile manifest, once per process"""
+    if path in loaded:
+        return loaded[path]
+
+    with open(path) as f:
+        manifest = json.load(f)
+    if not manifest.get("tiles"):
+        raise TileManifestError(f"{path}: no tiles")
+
+    directory = manifest.get("directory", os.path.dirname(path))
+    tile_types = TileTypes(manifest["tiles"], directory)
+    loaded[path] = tile_types
+    return tile_types
@@ -0,0 +1,70 @@
+"""Fixed timestep game loop helpers
+
+The simulation always advances in steps of 1 / FPS seconds however fast or slow frames are
+drawn. Real time between drawn frames is accumulated and spent in whole steps, and what is
+left over says how far between its last two steps the player should be drawn.
+"""
+import time
+import pygame
+from simulation import FPS
+
+# Longest time between frames that is caught up on, after a longer stall the game slows
+# down instead of running so many steps that the next frame is late as well
+MAX_FRAME_TIME = 0.25
+
+
+class FixedTimestep:
+    """Turns real time into a whole number of simulation steps"""
+    def __init__(self, rate=FPS, max_frame_time=MAX_FRAME_TIME):
+        self.step_time = 1 / rate
+        self.max_frame_time = max_frame_time
+        self.accumulator = 0.0
+
+    def reset(self):
+        """forget time not yet simulated, used when gameplay starts"""
+        self.accumulator = 0.0
+
+    def add(self, elapsed):
+        """add real time in seconds since the last frame"""
+        self.accumulator += min(elapsed, self.max_frame_time)
+
+    def steps(self):
+        """take the steps that are due, returns how many"""
+        steps = 0
+        while self.accumulator >= self.step_time:
+            self.accumulator -= self.step_time
+            steps += 1
+        return steps
+
+    def alpha(self):
+        """how far into the next step the time left over is, from 0 to 1"""
+        return self.accumulator / self.step_time
+
+
+class FramePacer:
+    """Paces drawn frames and measures the real time between them
+
+    fps caps the frame rate, 0 draws as fast as possible or as fast as vsync lets it.
+    busy_loop uses Clock.tick_busy_loop, which keeps the CPU busy but holds the cap more
+    precisely than the sleeping Clock.tick"""
+    def __init__(self, fps=FPS, busy_loop=False):
+        self.clock = pygame.time.Clock()
+        self.fps = fps
+        self.busy_loop = busy_loop
+        self.last_time = time.perf_counter()
+
+    def restart(self):
+        """measure the next frame from now"""
+        self.last_time = time.perf_counter()
+
+    def tick(self):
+        """wait for the next frame, returns seconds since the last one"""
+        if self.busy_loop:
+            self.clock.tick_busy_loop(self.fps)
+        else:
+            self.clock.tick(self.fps)
+
+        now = time.perf_counter()
+        elapsed = now - self.last_time
+        self.last_time = now
+        return elapsed
@@ -0,0 +1,177 @@
+import pygame
+import level_format
+
+class Camera:
+    """Viewport into a world larger than the screen, follows the player"""
+    def __init__(self, width, height):
+        self.rect = pygame.Rect(0, 0, width, height)
+
+    def follow(self, target, world_width, world_height):
+        """center on a rect while keeping the view inside the world"""
+        self.rect.center = target.center
+        self.rect.left = max(0, min(self.rect.left, world_width - self.rect.width))
+        self.rect.top = max(0, min(self.rect.top, world_height - self.rect.height))
+
+    def offset(self):
+        """what to add to world positions to get screen positions"""
+        return (-self.rect.x, -self.rect.y)
+
+
+class Chunk:
+    """Tiles, hitboxes and the rendered surface of one square piece of the world"""
+    __slots__ = ("tiles", "hitboxes", "surface")
+
+    def __init__(self, tiles, hitboxes):
+        self.tiles = tiles
+        self.hitboxes = hitboxes
+        self.surface = None
+
+
+class ChunkedWorld:
+    """Level streamed from a chunked level file, only chunks near the camera are kept in memory
+
+    Indexing works like world_data, world[y][x] is the tile at column x and row y"""
+    def __init__(self, path, tile_list, TILE_SIZE, keep_chunks=1):
+        self.file = level_format.ChunkedFile(path)
+        self.tile_list = tile_list
+        self.TILE_SIZE = TILE_SIZE
+        self.keep_chunks = keep_chunks
+
+        self.rows = self.file.rows
+        self.cols = self.file.cols
+        self.chunk_size = self.file.chunk_size
+        self.tileset = self.file.tileset
+        self.width = self.cols * TILE_SIZE
+        self.height = self.rows * TILE_SIZE
+
+        self.chunks = {}
+        self.tile_hitbox = None
+
+        # Chunk the rect followed by follow was last streamed around
+        self.followed_chunk = None
+
+    def close(self):
+        self.chunks = {}
+        self.followed_chunk = None
+        self.file.close()
+
+    def hitbox_grid(self, tile_hitbox):
+        """hitbox grid for PlayerPhysics, hitboxes are built per chunk with tile_hitbox"""
+        if tile_hitbox is not self.tile_hitbox:
+            self.tile_hitbox = tile_hitbox
+            self.chunks = {}
+        return HitboxGrid(self)
+
+    def chunk(self, cx, cy):
+        """a chunk, read from disk if it isnt loaded"""
+        chunk = self.chunks.get((cx, cy))
+        if chunk is None:
+            tiles = self.file.read_chunk(cx, cy)
+            hitboxes = None
+            if self.tile_hitbox is not None:
+                size = self.chunk_size
+                hitboxes = [
+                    [self.tile_hitbox(tile, cx * size + x, cy * size + y, self.TILE_SIZE) for x, tile in enumerate(row)]
+                    for y, row in enumerate(tiles)
+                ]
+            chunk = Chunk(tiles, hitboxes)
+            self.chunks[(cx, cy)] = chunk
+        return chunk
+
+    def chunk_range(self, rect, margin=0):
+        """chunk coordinates covering a rect in pixels, grown by margin chunks"""
+        chunk_pixels = self.chunk_size * self.TILE_SIZE
+        first_x = max(rect.left // chunk_pixels - margin, 0)
+        first_y = max(rect.top // chunk_pixels - margin, 0)
+        last_x = min((rect.right - 1) // chunk_pixels + margin, self.file.chunks_x - 1)
+        last_y = min((rect.bottom - 1) // chunk_pixels + margin, self.file.chunks_y - 1)
+        return [(cx, cy) for cy in range(first_y, last_y + 1) for cx in range(first_x, last_x + 1)]
+
+    def stream(self, view):
+        """load chunks around the view and evict the ones far behind it"""
+        for cx, cy in self.chunk_range(view, self.keep_chunks):
+            self.chunk(cx, cy)
+
+        keep = set(self.chunk_range(view, self.keep_chunks + 1))
+        for key in [key for key in self.chunks if key not in keep]:
+            del self.chunks[key]
+
+    def follow(self, rect):
+        """stream around a rect without a camera, like the player in a headless run
+
+        Chunks are only streamed again when the middle of the rect moves into another chunk"""
+        chunk_pixels = self.chunk_size * self.TILE_SIZE
+        chunk = (rect.centerx // chunk_pixels, rect.centery // chunk_pixels)
+        if chunk != self.followed_chunk:
+            self.followed_chunk = chunk
+            self.stream(rect)
+
+    def render_chunk(self, cx, cy):
+        """tiles of a chunk drawn once to a transparent surface"""
+        chunk = self.chunk(cx, cy)
+        if chunk.surface is None:
+            size = self.chunk_size * self.TILE_SIZE
+            chunk.surface = pygame.Surface((size, size), pygame.SRCALPHA).convert_alpha()
+            for y, row in enumerate(chunk.tiles):
+                for x, tile in enumerate(row):
+                    if tile >= 0:
+                        chunk.surface.blit(self.tile_list[tile], (x * self.TILE_SIZE, y * self.TILE_SIZE))
+        return chunk.surface
+
+    def draw(self, surface, camera):
+        """draw the chunks visible through the camera"""
+        chunk_pixels = self.chunk_size * self.TILE_SIZE
+        offset_x, offset_y = camera.offset()
+        for cx, cy in self.chunk_range(camera.rect):
+            surface.blit(self.render_chunk(cx, cy), (cx * chunk_pixels + offset_x, cy * chunk_pixels + offset_y))
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, y):
+        if not 0 <= y < self.rows:
+            raise IndexError(y)
+        return WorldRow(self, y, "tiles")
+
+
+class WorldRow:
+    """One row of a chunked world, indexing loads the chunk a cell is in"""
+    __slots__ = ("world", "y", "layer")
+
+    def __init__(self, world, y, layer):
+        self.world = world
+        self.y = y
+        self.layer = layer
+
+    def __len__(self):
+        return self.world.cols
+
+    def __getitem__(self, x):
+        if not 0 <= x < self.world.cols:
+            raise IndexError(x)
+        size = self.world.chunk_size
+        chunk = self.world.chunk(x // size, self.y // size)
+        return getattr(chunk, self.layer)[self.y % size][x % size]
+
+
+class HitboxGrid:
+    """Hitboxes of a chunked world indexed like PlayerPhysics.tile_hitboxes"""
+    __slots__ = ("world",)
+
+    def __init__(self, world):
+        self.world = world
+
+    def __len__(self):
+        return self.world.rows
+
+    def __getitem__(self, y):
+        if not 0 <= y < self.world.rows:
+            raise IndexError(y)
+        return WorldRow(self.world, y, "hitboxes")
+
+
+def open_world(path, tile_list=None, TILE_SIZE=32):
+    """open a level for playing, chunked levels are streamed and others read whole"""
+    if path.endswith(level_format.CHUNKED_EXTENSION):
+        return ChunkedWorld(path, tile_list, TILE_SIZE)
+    return level_format.read_level(path)[0]